@@ -18,4 +18,7 @@ from .query import *
 # =============== register scheduler ===============
 from .service.scheduler import Scheduler
 
+# ============= register cache warmer ==============
+from .service.cache_warmer import CacheWarmer
+
 __all__ = ("context",)
@@ -13,11 +13,25 @@ class Config(BaseSettings):
     blacklist: set[str] = set()
 
     pixiv_refresh_token: str
+    pixiv_refresh_tokens: List[str] = []
     pixiv_mongo_conn_url: str
     pixiv_mongo_database_name: str
     pixiv_proxy: Optional[str]
     pixiv_query_timeout: int = 60
     pixiv_simultaneous_query: int = 8
+    pixiv_simultaneous_page_query: int = 4
+    pixiv_api_rate_limit = 0.0
+    pixiv_api_rate_burst = 10
+    pixiv_image_rate_limit = 0.0
+    pixiv_image_rate_burst = 10
+    pixiv_image_conn_limit = 32
+    pixiv_image_conn_limit_per_host = 16
+    pixiv_image_keepalive_timeout = 30.0
+    pixiv_image_dns_cache_ttl = 300
+    pixiv_download_read_timeout = 30
+    pixiv_download_timeout = 300
+    pixiv_simultaneous_download = 8
+    pixiv_download_partial_path = "data/pixiv_bot/partial_download"
 
     pixiv_download_cache_expires_in = 3600 * 24 * 7
     pixiv_illust_detail_cache_expires_in = 3600 * 24 * 7
@@ -30,15 +44,32 @@ class Config(BaseSettings):
     pixiv_related_illusts_cache_expires_in = 3600 * 24
     pixiv_other_cache_expires_in = 3600 * 6
 
+    pixiv_memory_cache_enabled = True
+    pixiv_memory_cache_max_item = 16
+    pixiv_memory_cache_detail_max_item = 1024
+
+    pixiv_cache_stale_while_revalidate = False
+    pixiv_cache_stale_max_age = 3600 * 24
+
     pixiv_block_tags: List[str] = []
     pixiv_block_action: BlockAction = BlockAction.no_image
 
     pixiv_download_quantity: DownloadQuantity = DownloadQuantity.original
     pixiv_download_custom_domain: Optional[str]
+    pixiv_download_max_page = 1
+
+    pixiv_image_store: ImageStoreType = ImageStoreType.local
+    pixiv_image_store_path = "data/pixiv_bot/image_cache"
+    pixiv_download_cache_clean_interval = 3600
+    pixiv_download_cache_max_bytes = 0
+    pixiv_download_cache_eviction_policy: CacheEvictionPolicy = CacheEvictionPolicy.lru
+    pixiv_download_cache_keep_original = True
 
     pixiv_compression_enabled: bool = False
     pixiv_compression_max_size: Optional[int]
     pixiv_compression_quantity: Optional[float]
+    pixiv_compression_backend: CompressorBackend = CompressorBackend.thread
+    pixiv_compression_max_queued = 32
 
     @validator('pixiv_compression_max_size', 'pixiv_compression_quantity')
     def compression_validator(cls, v, values, field: ModelField):
@@ -83,6 +114,10 @@ class Config(BaseSettings):
     pixiv_more_enabled = True
     pixiv_query_expires_in = 10 * 60
 
+    pixiv_subscription_prefetch_lead = 0
+    pixiv_subscription_jitter = 0
+    pixiv_post_interval = 0.0
+
     pixiv_illust_query_enabled = True
 
     pixiv_ranking_query_enabled = True
@@ -90,6 +125,8 @@ class Config(BaseSettings):
     pixiv_ranking_default_range = [1, 3]
     pixiv_ranking_fetch_item = 150
     pixiv_ranking_max_item_per_query = 10
+    pixiv_ranking_warm_up_enabled = False
+    pixiv_ranking_warm_up_time = "12:05"
 
     @validator('pixiv_ranking_default_range')
     def ranking_default_range_validator(cls, v, field: ModelField):
@@ -97,12 +134,23 @@ class Config(BaseSettings):
             raise ValueError(f'illegal {field.name} value: {v}')
         return v
 
+    @validator('pixiv_ranking_warm_up_time')
+    def ranking_warm_up_time_validator(cls, v, field: ModelField):
+        try:
+            hour, minute = map(int, v.split(":"))
+        except ValueError:
+            raise ValueError(f'{field.name} expected a time in format HH:MM, but got {v}')
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f'illegal {field.name} value: {v}')
+        return f'{hour:02d}:{minute:02d}'
+
     pixiv_random_illust_query_enabled = True
     pixiv_random_illust_method = RandomIllustMethod.bookmark_proportion
     pixiv_random_illust_min_bookmark = 0
     pixiv_random_illust_min_view = 0
     pixiv_random_illust_max_page = 20
     pixiv_random_illust_max_item = 500
+    pixiv_random_illust_eager_fetch = False
 
     pixiv_random_recommended_illust_query_enabled = True
     pixiv_random_recommended_illust_method = RandomIllustMethod.uniform
@@ -0,0 +1,5 @@
+from .gridfs_image_store import GridFSImageStore
+from .image_store import ImageStore
+from .local_image_store import LocalImageStore
+
+__all__ = ("ImageStore", "LocalImageStore", "GridFSImageStore")
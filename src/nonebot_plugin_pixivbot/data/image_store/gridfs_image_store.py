@@ -0,0 +1,76 @@
+from asyncio import get_running_loop
+from os import PathLike
+from typing import Optional, Union
+
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+from nonebot_plugin_pixivbot.global_context import context
+from .image_store import ImageStore
+from ..source import MongoDataSource
+
+
+@context.register_singleton()
+class GridFSImageStore(ImageStore):
+    """
+    将图片保存在MongoDB的GridFS中，适用于多个节点共用同一个数据库的部署
+    """
+
+    def __init__(self):
+        self.mongo = context.require(MongoDataSource)
+        self._bucket = None
+
+    @property
+    def bucket(self) -> AsyncIOMotorGridFSBucket:
+        # 数据库在启动后才可用，因此在第一次使用时创建
+        if self._bucket is None:
+            self._bucket = AsyncIOMotorGridFSBucket(self.mongo.db, bucket_name="image_cache")
+        return self._bucket
+
+    async def load(self, key: str) -> Optional[bytes]:
+        try:
+            grid_out = await self.bucket.open_download_stream_by_name(key)
+        except NoFile:
+            return None
+        return await grid_out.read()
+
+    async def _delete_old_versions(self, key: str, file_id):
+        # 同名的旧版本在新版本写入后再删除
+        async for x in self.bucket.find({"filename": key, "_id": {"$ne": file_id}}):
+            await self.bucket.delete(x._id)
+
+    async def save(self, key: str, content: bytes):
+        file_id = await self.bucket.upload_from_stream(key, content)
+        await self._delete_old_versions(key, file_id)
+
+    async def save_file(self, key: str, path: Union[str, PathLike], chunk_size: int = 256 * 1024):
+        # 文件的打开及读取在线程池中进行，不阻塞事件循环
+        loop = get_running_loop()
+        f = await loop.run_in_executor(None, open, path, "rb")
+        try:
+            grid_in = self.bucket.open_upload_stream(key)
+            try:
+                while True:
+                    chunk = await loop.run_in_executor(None, f.read, chunk_size)
+                    if not chunk:
+                        break
+                    await grid_in.write(chunk)
+            except BaseException:
+                await grid_in.abort()
+                raise
+            await grid_in.close()
+        finally:
+            f.close()
+
+        await self._delete_old_versions(key, grid_in._id)
+
+    async def delete(self, key: str):
+        bucket = self.bucket
+        async for x in bucket.find({"filename": key}):
+            await bucket.delete(x._id)
+
+    async def clear(self):
+        await self.bucket.drop()
+
+
+__all__ = ("GridFSImageStore",)
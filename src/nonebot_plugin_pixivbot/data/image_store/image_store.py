@@ -0,0 +1,35 @@
+from abc import ABC, abstractmethod
+from os import PathLike
+from typing import Optional, Union
+
+
+class ImageStore(ABC):
+    """
+    图片内容的存储后端，download_cache中只保存元数据（key、大小、更新时间）
+    """
+
+    @abstractmethod
+    async def load(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def save(self, key: str, content: bytes):
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def save_file(self, key: str, path: Union[str, PathLike]):
+        """
+        保存本地文件中的图片（保存后该文件可能被移走），避免将整张图片读入内存
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def delete(self, key: str):
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def clear(self):
+        raise NotImplementedError()
+
+
+__all__ = ("ImageStore",)
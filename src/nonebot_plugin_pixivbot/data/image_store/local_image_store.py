@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+from asyncio import get_running_loop
+from hashlib import sha1
+from pathlib import Path
+from typing import Optional, Union, Tuple
+
+from nonebot_plugin_pixivbot.config import Config
+from nonebot_plugin_pixivbot.global_context import context
+from .image_store import ImageStore
+
+
+@context.register_singleton()
+class LocalImageStore(ImageStore):
+    """
+    将图片保存在本地文件系统，按key的哈希分两级目录存放
+    """
+    _conf: Config = context.require(Config)
+
+    def __init__(self):
+        self.root = Path(self._conf.pixiv_image_store_path)
+
+    def path(self, key: str) -> Path:
+        digest = sha1(key.encode()).hexdigest()
+        return self.root / digest[:2] / digest[2:4] / key
+
+    @staticmethod
+    async def _run(func, *args):
+        return await get_running_loop().run_in_executor(None, func, *args)
+
+    @staticmethod
+    def _read(path: Path) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _mkstemp(path: Path) -> Tuple[int, str]:
+        # 每次写入使用各自的临时文件，同一key的并发写入不会互相覆盖
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return tempfile.mkstemp(prefix=path.name + ".", suffix=".tmp", dir=path.parent)
+
+    @classmethod
+    def _write(cls, path: Path, content: bytes):
+        fd, tmp_path = cls._mkstemp(path)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            cls._unlink(tmp_path)
+            raise
+
+    @classmethod
+    def _move(cls, src: Union[str, os.PathLike], path: Path):
+        fd, tmp_path = cls._mkstemp(path)
+        os.close(fd)
+        try:
+            shutil.move(src, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            cls._unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def _unlink(path: Union[str, os.PathLike]):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    async def load(self, key: str) -> Optional[bytes]:
+        return await self._run(self._read, self.path(key))
+
+    async def save(self, key: str, content: bytes):
+        await self._run(self._write, self.path(key), content)
+
+    async def save_file(self, key: str, path: Union[str, os.PathLike]):
+        await self._run(self._move, path, self.path(key))
+
+    async def delete(self, key: str):
+        await self._run(self._unlink, self.path(key))
+
+    async def clear(self):
+        await self._run(shutil.rmtree, self.root, True)
+
+
+__all__ = ("LocalImageStore",)
@@ -1,4 +1,5 @@
+from .illust_list import IllustList
 from .lazy_illust import LazyIllust
 from .repo import PixivRepo
 
-__all__ = ("PixivRepo", "LazyIllust",)
+__all__ = ("PixivRepo", "LazyIllust", "IllustList",)
@@ -45,5 +45,5 @@ class AbstractPixivRepo(ABC):
         raise NotImplementedError()
 
     @abstractmethod
-    async def image(self, illust: Illust) -> bytes:
+    async def image(self, illust: Illust, page: int = 0) -> bytes:
         raise NotImplementedError()
@@ -1,54 +1,198 @@
 import asyncio
 import functools
+import math
 import multiprocessing
+import typing
+from concurrent.futures.process import ProcessPoolExecutor
 from concurrent.futures.thread import ThreadPoolExecutor
 from io import BytesIO
+from os import PathLike
 
-from PIL import Image, ImageFile
+from PIL import Image
 
 from nonebot_plugin_pixivbot.config import Config
+from nonebot_plugin_pixivbot.enums import DownloadQuantity, CompressorBackend
 from .pkg_context import context
+from ...utils.lifecycler import on_shutdown
+
+# Pixiv各尺寸的图片规格：(最大宽度, 最大高度, JPEG质量, 是否裁剪为正方形)
+QUANTITY_SPECS = {
+    DownloadQuantity.large: (600, 1200, 90, False),
+    DownloadQuantity.medium: (540, 540, 70, False),
+    DownloadQuantity.square_medium: (360, 360, 70, True),
+}
 
 
 @context.register_singleton()
 class Compressor:
     _conf: Config = context.require(Config)
 
+    RAW_PROFILE = "raw"
+
     def __init__(self) -> None:
         self.enabled = self._conf.pixiv_compression_enabled
         self.max_size = self._conf.pixiv_compression_max_size
         self.quantity = self._conf.pixiv_compression_quantity
 
-        if self.enabled:
-            cpu_count = multiprocessing.cpu_count()
+        # 从原图派生其他尺寸时同样需要线程池/进程池，因此不论是否启用压缩都创建
+        cpu_count = multiprocessing.cpu_count()
+        if self._conf.pixiv_compression_backend == CompressorBackend.process:
+            # 进程池中只传递bytes或文件路径，_compress须为模块级函数以便pickle
+            self._executor = ProcessPoolExecutor(cpu_count)
+        else:
             self._executor = ThreadPoolExecutor(cpu_count, "compressor")
-            # logger.info(f"A ThreadPool with {cpu_count} worker(s) was created for compression")
+        # logger.info(f"A ThreadPool with {cpu_count} worker(s) was created for compression")
+
+        # 限制同时处理的图片数，避免突发的大量请求将待压缩的图片全部堆积在内存中（在事件循环中创建）
+        self._queue = None
 
-    async def compress(self, content: bytes) -> bytes:
+        on_shutdown(self.shutdown)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def profile(self) -> str:
+        """
+        当前压缩配置的标识，作为图片缓存键的一部分
+        """
         if self.enabled:
-            loop = asyncio.get_running_loop()
-            task = loop.run_in_executor(
-                self._executor, functools.partial(self._compress, content))
-            return await task
+            return f"{self.max_size}q{self.quantity}"
         else:
-            return content
+            return self.RAW_PROFILE
+
+    @property
+    def queue(self) -> asyncio.Semaphore:
+        """
+        同时处理的图片数的限制（pixiv_compression_max_queued）。
+        调用者须在下载或读取待处理的图片之前获取，使等待中的请求不在内存中持有图片
+        """
+        if self._queue is None:
+            self._queue = asyncio.Semaphore(self._conf.pixiv_compression_max_queued)
+        return self._queue
 
-    def _compress(self, content: bytes) -> bytes:
-        p = ImageFile.Parser()
-        p.feed(content)
-        img = p.close()
-
-        w, h = img.size
-        if w > self.max_size or h > self.max_size:
-            ratio = min(self.max_size / w,
-                        self.max_size / h)
-            img_cp = img.resize(
-                (int(ratio * w), int(ratio * h)), Image.ANTIALIAS)
+    async def _run(self, content: typing.Union[bytes, str],
+                   max_width: int, max_height: int, quality: int, square: bool) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(_compress, content, max_width, max_height, quality, square))
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    async def compress(self, content: typing.Union[bytes, str, PathLike]) -> bytes:
+        """
+        :param content: 图片内容，或图片文件的路径（避免将未压缩的图片读入内存）
+        """
+        if not isinstance(content, bytes):
+            content = str(content)
+
+        if self.enabled:
+            return await self._run(content, self.max_size, self.max_size, int(self.quantity), False)
+        elif isinstance(content, str):
+            return await asyncio.get_running_loop().run_in_executor(None, self._read, content)
         else:
-            img_cp = img.copy()
-        img_cp = img_cp.convert("RGB")
+            return content
+
+    async def derive(self, original: typing.Union[bytes, str, PathLike], quantity: DownloadQuantity) -> bytes:
+        """
+        从原图在本地派生出指定尺寸的图片（并应用当前压缩配置），代替重新下载
+        :param original: 原图内容，或原图文件的路径
+        """
+        if not isinstance(original, bytes):
+            original = str(original)
+
+        if quantity == DownloadQuantity.original:
+            return await self.compress(original)
+
+        max_width, max_height, quality, square = QUANTITY_SPECS[quantity]
+        if self.enabled:
+            max_width = min(max_width, self.max_size)
+            max_height = min(max_height, self.max_size)
+            quality = int(self.quantity)
+        return await self._run(original, max_width, max_height, quality, square)
+
+
+# libjpeg的标准亮度量化表（质量50），用于估计JPEG的压缩质量
+_STD_LUMINANCE_QUANT_TABLE_SUM = sum((
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+))
+
+
+def _estimate_jpeg_quality(img: Image.Image) -> typing.Optional[int]:
+    """
+    根据亮度量化表估计JPEG的压缩质量（按libjpeg的缩放公式反推），无法估计时返回None
+    """
+    tables = getattr(img, "quantization", None)
+    if not tables or 0 not in tables:
+        return None
+
+    scale = sum(tables[0]) * 100 / _STD_LUMINANCE_QUANT_TABLE_SUM
+    if scale <= 100:
+        return round((200 - scale) / 2)
+    else:
+        return round(5000 / scale)
+
+
+def _compress(content: typing.Union[bytes, str], max_width: int, max_height: int, quality: int, square: bool) -> bytes:
+    """
+    :param content: 图片内容，或图片文件的路径（进程池中只传递路径，不必复制整张图片）
+    """
+    with Image.open(BytesIO(content) if isinstance(content, bytes) else content) as img:
+        return _compress_image(img, content, max_width, max_height, quality, square)
+
+
+def _compress_image(img: Image.Image, content: typing.Union[bytes, str],
+                    max_width: int, max_height: int, quality: int, square: bool) -> bytes:
+    w, h = img.size
+    edge = min(w, h) if square else None
+    crop_w, crop_h = (edge, edge) if square else (w, h)
+    ratio = min(max_width / crop_w, max_height / crop_h, 1)
+
+    if img.format == "JPEG":
+        # 原图已经满足尺寸及质量要求时直接返回，不再重新编码
+        if ratio == 1 and (not square or w == h):
+            src_quality = _estimate_jpeg_quality(img)
+            if src_quality is not None and src_quality <= quality:
+                if isinstance(content, bytes):
+                    return content
+                with open(content, "rb") as f:
+                    return f.read()
+
+        # 按目标尺寸以1/2、1/4或1/8的比例解码（draft保证解码结果不小于请求的尺寸）
+        if ratio < 1:
+            img.draft("RGB", (math.ceil(w * ratio), math.ceil(h * ratio)))
+            scale = img.size[0] / w
+            w, h = img.size
+            if square:
+                edge = min(w, h)
+            ratio = min(ratio / scale, 1)
+
+    if square and w != h:
+        left, top = (w - edge) // 2, (h - edge) // 2
+        img = img.crop((left, top, left + edge, top + edge))
+        w, h = edge, edge
+
+    if ratio < 1:
+        img_cp = img.resize(
+            (int(ratio * w), int(ratio * h)), Image.ANTIALIAS)
+    else:
+        img_cp = img
+    img_cp = img_cp.convert("RGB")
+
+    with BytesIO() as bio:
+        img_cp.save(bio, format="JPEG", optimize=True,
+                    quality=quality)
+        return bio.getvalue()
+
 
-        with BytesIO() as bio:
-            img_cp.save(bio, format="JPEG", optimize=True,
-                        quantity=self.quantity)
-            return bio.getvalue()
+__all__ = ("Compressor",)
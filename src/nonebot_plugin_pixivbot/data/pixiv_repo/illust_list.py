@@ -0,0 +1,89 @@
+from collections.abc import Sequence
+from typing import Any, Callable, Dict, Iterable, Union
+
+import numpy as np
+
+from nonebot_plugin_pixivbot.model import Illust
+from .lazy_illust import LazyIllust
+
+
+class IllustList(Sequence):
+    """
+    以列存储的插画列表：只保存id及抽选所需的字段（书签数、查看数、发布时间戳、是否有详情、是否含有屏蔽标签），不保留完整的Illust。
+    取出的项为不含详情的LazyIllust（取出后缓存在列表上），只有被选中的项才需要加载详情。
+    由各列导出的数据（如roulette的权重）缓存在列表上，同一个列表对象（如进程内缓存中的列表）多次抽选时只计算一次
+    """
+
+    __slots__ = ("ids", "total_bookmarks", "total_view", "create_timestamp", "loaded", "blocked", "_derived", "_items")
+
+    def __init__(self, illusts: Iterable[Union[LazyIllust, Illust]] = ()):
+        ids, total_bookmarks, total_view, create_timestamp, loaded = [], [], [], [], []
+        for x in illusts:
+            content = x.content if isinstance(x, LazyIllust) else x
+            ids.append(x.id)
+            if content is not None:
+                total_bookmarks.append(content.total_bookmarks)
+                total_view.append(content.total_view)
+                create_timestamp.append(content.create_date.timestamp())
+                loaded.append(True)
+            else:
+                total_bookmarks.append(0)
+                total_view.append(0)
+                create_timestamp.append(0)
+                loaded.append(False)
+
+        self._set_columns(ids, total_bookmarks, total_view, create_timestamp, loaded, [False] * len(ids))
+
+    def _set_columns(self, ids, total_bookmarks, total_view, create_timestamp, loaded, blocked):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.total_bookmarks = np.asarray(total_bookmarks, dtype=np.int64)
+        self.total_view = np.asarray(total_view, dtype=np.int64)
+        self.create_timestamp = np.asarray(create_timestamp, dtype=np.float64)
+        self.loaded = np.asarray(loaded, dtype=np.bool_)
+        self.blocked = np.asarray(blocked, dtype=np.bool_)
+        self._derived: Dict[Any, Any] = {}
+        # 已取出的项，再次取出时返回同一个LazyIllust（保留已加载的详情）
+        self._items: Dict[int, LazyIllust] = {}
+
+    @classmethod
+    def from_columns(cls, ids, total_bookmarks, total_view, create_timestamp, loaded, blocked) -> "IllustList":
+        """
+        直接由各列构造（如缓存中只投影出摘要字段的查询结果）
+        :param blocked: 是否应被屏蔽（不会被抽中）
+        """
+        illusts = cls.__new__(cls)
+        illusts._set_columns(ids, total_bookmarks, total_view, create_timestamp, loaded, blocked)
+        return illusts
+
+    def derive(self, key: Any, func: Callable[["IllustList"], Any]) -> Any:
+        """
+        返回由func计算并以key缓存的数据
+        """
+        if key not in self._derived:
+            self._derived[key] = func(self)
+        return self._derived[key]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return IllustList.from_columns(self.ids[item], self.total_bookmarks[item], self.total_view[item],
+                                           self.create_timestamp[item], self.loaded[item], self.blocked[item])
+        item = int(item)
+        if item < 0:
+            item += len(self.ids)
+        if not 0 <= item < len(self.ids):
+            raise IndexError("IllustList index out of range")
+
+        x = self._items.get(item)
+        if x is None:
+            x = LazyIllust(int(self.ids[item]))
+            self._items[item] = x
+        return x
+
+    def __repr__(self) -> str:
+        return f"IllustList({self.ids.tolist()})"
+
+
+__all__ = ("IllustList",)
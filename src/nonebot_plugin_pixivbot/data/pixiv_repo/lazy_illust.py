@@ -15,6 +15,8 @@ def _get_src():
 
 
 class LazyIllust:
+    __slots__ = ("id", "content")
+
     src = LazyDelegation(_get_src)
 
     def __init__(self, id: int, content: Optional[Illust] = None) -> None:
@@ -1,84 +1,198 @@
+import json
+import os
 import typing
-from datetime import datetime
+from datetime import datetime, timedelta
+from hashlib import sha1
+from time import time
 
-import bson
+import numpy as np
 from nonebot import logger
 from pymongo import UpdateOne
 
-from nonebot_plugin_pixivbot.enums import RankingMode
+from nonebot_plugin_pixivbot.config import Config
+from nonebot_plugin_pixivbot.enums import RankingMode, CacheEvictionPolicy, DownloadQuantity, BlockAction
 from nonebot_plugin_pixivbot.model import Illust, User
 from .abstract_repo import AbstractPixivRepo
+from ..image_store import ImageStore
+from .illust_list import IllustList
 from .lazy_illust import LazyIllust
+from .mediator import StaleCache
+from .memory_cache import MemoryCache
 from .pkg_context import context
+from .utils import do_skip_and_limit, create_background_task
 from ..source import MongoDataSource
+from ..source.mongo.illust_summary import ILLUST_SUMMARY_VERSION, summarize_illust, aggregate_list_summaries
+
+# 插画详情中会随时间变化的计数，不计入指纹
+_COUNTER_FIELDS = ("total_view", "total_bookmarks")
+
+
+def _illust_fingerprint(illust_dict: typing.Dict[str, typing.Any]) -> str:
+    content = {k: v for k, v in illust_dict.items() if k not in _COUNTER_FIELDS}
+    return sha1(json.dumps(content, sort_keys=True, ensure_ascii=False, default=str).encode()).hexdigest()
 
 
 @context.register_singleton()
 class LocalPixivRepo(AbstractPixivRepo):
+    _conf: Config = context.require(Config)
+
     def __init__(self):
         self.mongo = context.require(MongoDataSource)
+        self.image_store = context.require(ImageStore)
+
+        self._expires_in = {
+            "illust_detail_cache": self._conf.pixiv_illust_detail_cache_expires_in,
+            "user_detail_cache": self._conf.pixiv_user_detail_cache_expires_in,
+            "search_illust_cache": self._conf.pixiv_search_illust_cache_expires_in,
+            "search_user_cache": self._conf.pixiv_search_user_cache_expires_in,
+            "user_illusts_cache": self._conf.pixiv_user_illusts_cache_expires_in,
+            "user_bookmarks_cache": self._conf.pixiv_user_bookmarks_cache_expires_in,
+            "related_illusts_cache": self._conf.pixiv_related_illusts_cache_expires_in,
+            "other_cache": self._conf.pixiv_other_cache_expires_in,
+        }
+
+        # 进程内缓存，位于Mongo之前，每种缓存各自计数并使用与Mongo相同的过期时间
+        self._memory: typing.Dict[str, MemoryCache] = {}
+        if self._conf.pixiv_memory_cache_enabled:
+            for collection_name, expires_in in self._expires_in.items():
+                if collection_name in ("illust_detail_cache", "user_detail_cache"):
+                    # 详情的条目小而数量多，单独设置上限
+                    max_item = self._conf.pixiv_memory_cache_detail_max_item
+                else:
+                    max_item = self._conf.pixiv_memory_cache_max_item
+                self._memory[collection_name] = MemoryCache(max_item, expires_in)
+
+        # 尚未写入Mongo的图片访问记录：download_cache的_id -> [访问次数, 最后访问时间]
+        self._image_access: typing.Dict[typing.Any, typing.List[typing.Any]] = {}
+
+        # 正在后台重建摘要的列表：(collection_name, arg)
+        self._refreshing_summaries: typing.Set[typing.Tuple[str, typing.Any]] = set()
+
+    def _memory_get(self, collection_name: str, key: typing.Any) -> typing.Optional[typing.Any]:
+        memory = self._memory.get(collection_name)
+        if memory is None:
+            return None
+
+        value = memory.get(key)
+        if value is not None:
+            logger.debug(f"[memory] {collection_name} {key} hit ({memory})")
+        return value
+
+    def _memory_put(self, collection_name: str, key: typing.Any, value: typing.Any,
+                    update_time: typing.Optional[datetime] = None):
+        memory = self._memory.get(collection_name)
+        if memory is not None:
+            memory.put(key, value, update_time)
+
+    def _mark_stale(self, collection_name: str, content: typing.Any,
+                    update_time: typing.Optional[datetime]) -> typing.Any:
+        # 启用stale-while-revalidate时，Mongo中的缓存会多保留pixiv_cache_stale_max_age秒
+        # 这段时间内读到的缓存包装为StaleCache，由Mediator立即返回并在后台刷新
+        if self._conf.pixiv_cache_stale_while_revalidate and update_time is not None \
+                and update_time.timestamp() + self._expires_in[collection_name] < time():
+            return StaleCache(content)
+        return content
+
+    def _illust_list_from_summaries(self, summaries: typing.List[typing.Dict[str, typing.Any]]) -> IllustList:
+        # no_image时含有屏蔽标签的插画仍会被抽中，只是发送时不带图片
+        if self._conf.pixiv_block_action == BlockAction.no_image:
+            block_tags = set()
+        else:
+            block_tags = set(self._conf.pixiv_block_tags)
+
+        ids, total_bookmarks, total_view, create_timestamp, loaded, blocked = [], [], [], [], [], []
+        for x in summaries:
+            ids.append(x["id"])
+            if "total_bookmarks" in x:
+                total_bookmarks.append(x["total_bookmarks"])
+                total_view.append(x["total_view"])
+                create_timestamp.append(x["create_timestamp"])
+                loaded.append(True)
+                blocked.append(not block_tags.isdisjoint(x["tags"]))
+            else:
+                total_bookmarks.append(0)
+                total_view.append(0)
+                create_timestamp.append(0)
+                loaded.append(False)
+                blocked.append(False)
+
+        return IllustList.from_columns(ids, total_bookmarks, total_view, create_timestamp, loaded, blocked)
+
+    def _summaries_outdated(self, summary_time: typing.Optional[datetime]) -> bool:
+        # 插画详情在此期间可能已被重新获取（计数、标签等发生变化），而列表本身尚未过期
+        return summary_time is None or \
+            summary_time.timestamp() + self._conf.pixiv_illust_detail_cache_expires_in / 2 < time()
+
+    def _schedule_refresh_summaries(self, collection_name: str, arg: typing.Any, doc_id: typing.Any,
+                                    update_time: typing.Optional[datetime],
+                                    summaries: typing.Optional[typing.List[typing.Dict[str, typing.Any]]] = None):
+        key = (collection_name, arg)
+        if key in self._refreshing_summaries:
+            return
+
+        self._refreshing_summaries.add(key)
+        task = create_background_task(self._refresh_summaries(collection_name, arg, doc_id, update_time, summaries),
+                                      f"refresh summaries of {collection_name} {arg}")
+        task.add_done_callback(lambda _: self._refreshing_summaries.discard(key))
+
+    async def _refresh_summaries(self, collection_name: str, arg: typing.Any, doc_id: typing.Any,
+                                 update_time: typing.Optional[datetime],
+                                 summaries: typing.Optional[typing.List[typing.Dict[str, typing.Any]]] = None):
+        """
+        重建列表缓存文档的摘要（summaries为None时由当前的插画详情生成）并写回，期间列表被重新写入时放弃
+        """
+        if summaries is None:
+            summaries_of = await aggregate_list_summaries(self.mongo.db, collection_name, {"_id": doc_id})
+            summaries = summaries_of.get(doc_id, [])
+
+        result = await self.mongo.db[collection_name].update_one(
+            {"_id": doc_id, "update_time": update_time},
+            {"$set": {
+                "summaries": summaries,
+                "summary_version": ILLUST_SUMMARY_VERSION,
+                "summary_time": datetime.now()
+            }}
+        )
+        if result.matched_count != 0:
+            self._memory_put(collection_name, arg, self._illust_list_from_summaries(summaries), update_time)
+            logger.info(f"[cache] {collection_name} {arg} summaries refreshed")
 
     def _make_illusts_cache_loader(self, collection_name: str, arg_name: str, arg: typing.Any, *, skip: int = 0,
                                    limit: int = 0):
-        async def cache_loader() -> typing.Optional[typing.List[LazyIllust]]:
-            aggregation = [
-                {
-                    "$match": {arg_name: arg}
-                },
-                {
-                    "$replaceWith": {"illust_id": "$illust_id"}
-                },
-                {
-                    "$unwind": "$illust_id"
-                },
-            ]
-
-            if skip:
-                aggregation.append({"$skip": skip})
-            if limit:
-                aggregation.append({"$limit": limit})
-
-            aggregation.extend([
-                {
-                    "$lookup": {
-                        "from": "illust_detail_cache",
-                        "localField": "illust_id",
-                        "foreignField": "illust.id",
-                        "as": "illusts"
-                    }
-                },
-                {
-                    "$replaceWith": {
-                        "$mergeObjects": [
-                            "$$ROOT",
-                            {"$arrayElemAt": ["$illusts", 0]}
-                        ]
-                    }
-                },
-                {
-                    "$project": {"_id": 0, "illust": 1, "illust_id": 1}
-                }
-            ])
+        async def cache_loader() -> typing.Optional[IllustList]:
+            cache = self._memory_get(collection_name, arg)
+            if cache is not None:
+                return do_skip_and_limit(cache, skip, limit)
+
+            # 列表缓存文档内嵌了每项抽选所需的摘要，读取列表只需一次查询
+            # 被选中的项再通过illust_details读取完整的详情
+            doc = await self.mongo.db[collection_name].find_one(
+                {arg_name: arg},
+                {"illust_id": 1, "summaries": 1, "summary_version": 1, "summary_time": 1, "update_time": 1}
+            )
+            if doc is None or len(doc.get("illust_id", [])) == 0:
+                return None
 
-            result = self.mongo.db[collection_name].aggregate(aggregation)
+            update_time = doc.get("update_time")
+            if doc.get("summary_version") == ILLUST_SUMMARY_VERSION:
+                summaries = doc["summaries"]
+                if self._summaries_outdated(doc.get("summary_time", update_time)):
+                    # 摘要可能落后于插画详情：本次仍使用现有的摘要，在后台重建
+                    self._schedule_refresh_summaries(collection_name, arg, doc["_id"], update_time)
+            else:
+                # 旧版本的摘要：$lookup插画详情并只投影摘要所需的字段重新生成，在后台写回
+                summaries_of = await aggregate_list_summaries(self.mongo.db, collection_name, {"_id": doc["_id"]})
+                summaries = summaries_of.get(doc["_id"], [])
+                self._schedule_refresh_summaries(collection_name, arg, doc["_id"], update_time, summaries)
 
-            cache = []
-            broken = 0
-            async for x in result:
-                if "illust" in x and x["illust"] is not None:
-                    cache.append(LazyIllust(
-                        x["illust_id"], Illust.parse_obj(x["illust"])))
-                else:
-                    cache.append(LazyIllust(x["illust_id"]))
-                    broken += 1
+            cache = self._illust_list_from_summaries(summaries)
 
             logger.info(
-                f"[cache] {len(cache)} got, illust_detail of {broken} are missed")
+                f"[cache] {len(cache)} got, illust_detail of {len(cache) - np.count_nonzero(cache.loaded)} are missed")
 
-            if len(cache) != 0:
-                return cache
-            else:
-                return None
+            self._memory_put(collection_name, arg, cache, update_time)
+            cache = do_skip_and_limit(cache, skip, limit)
+            return self._mark_stale(collection_name, cache, update_time)
 
         return cache_loader
 
@@ -87,67 +201,163 @@ class LocalPixivRepo(AbstractPixivRepo):
                                     arg: typing.Any):
         async def cache_updater(content: typing.List[typing.Union[Illust, LazyIllust]]):
             now = datetime.now()
+
+            summaries = []
+            illust_dicts = []
+            for illust in content:
+                if isinstance(illust, LazyIllust) and illust.content is not None:
+                    illust = illust.content
+
+                if isinstance(illust, Illust):
+                    illust_dict = illust.dict()
+                    summaries.append(summarize_illust(illust_dict))
+                    illust_dicts.append(illust_dict)
+                else:
+                    summaries.append({"id": illust.id})
+
             await self.mongo.db[collection_name].update_one(
                 {arg_name: arg},
                 {"$set": {
-                    "illust_id": [illust.id for illust in content],
+                    "illust_id": [x["id"] for x in summaries],
+                    "summaries": summaries,
+                    "summary_version": ILLUST_SUMMARY_VERSION,
+                    "summary_time": now,
                     "update_time": now
                 }},
                 upsert=True
             )
 
-            opt = []
-            for illust in content:
-                if isinstance(illust, LazyIllust) and illust.content is not None:
-                    illust = illust.content
+            self._memory_put(collection_name, arg, self._illust_list_from_summaries(summaries), now)
 
-                if isinstance(illust, Illust):
-                    opt.append(UpdateOne(
-                        {"illust.id": illust.id},
-                        {"$set": {
-                            "illust": illust.dict(),
-                            "update_time": now
-                        }},
-                        upsert=True
-                    ))
-            if len(opt) != 0:
-                await self.mongo.db.illust_detail_cache.bulk_write(opt, ordered=False)
+            await self._upsert_illust_details(illust_dicts, now)
 
         return cache_updater
 
+    async def _upsert_illust_details(self, illust_dicts: typing.Sequence[typing.Dict[str, typing.Any]],
+                                     now: datetime):
+        """
+        批量写入插画详情：与缓存中的指纹比较，内容变化的整个写入，只有计数变化的只更新计数，
+        未变化的不写入（除非update_time已过去一半的过期时间，此时只更新update_time，避免被TTL索引删除）
+        """
+        illust_dicts = {x["id"]: x for x in illust_dicts}
+        if len(illust_dicts) == 0:
+            return
+
+        cached = {}
+        async for x in self.mongo.db.illust_detail_cache.find(
+                {"illust.id": {"$in": list(illust_dicts)}},
+                {"_id": 0, "illust.id": 1, "illust.total_view": 1, "illust.total_bookmarks": 1, "fingerprint": 1,
+                 "update_time": 1}):
+            cached[x["illust"]["id"]] = x
+
+        touch_before = now - timedelta(seconds=self._expires_in["illust_detail_cache"] / 2)
+
+        opt = []
+        changed, counter_changed = 0, 0
+        for illust_id, illust_dict in illust_dicts.items():
+            fingerprint = _illust_fingerprint(illust_dict)
+            old = cached.get(illust_id)
+
+            if old is None or old.get("fingerprint") != fingerprint:
+                changed += 1
+                update = {"illust": illust_dict, "fingerprint": fingerprint, "update_time": now}
+            elif any(old["illust"].get(k) != illust_dict[k] for k in _COUNTER_FIELDS):
+                counter_changed += 1
+                update = {f"illust.{k}": illust_dict[k] for k in _COUNTER_FIELDS}
+                update["update_time"] = now
+            elif old.get("update_time") is None or old["update_time"] < touch_before:
+                update = {"update_time": now}
+            else:
+                continue
+
+            opt.append(UpdateOne({"illust.id": illust_id}, {"$set": update}, upsert=True))
+
+        # 进程内缓存中的详情可能已经过时，写入后使其失效
+        memory = self._memory.get("illust_detail_cache")
+        if memory is not None:
+            for illust_id in illust_dicts:
+                memory.invalidate(illust_id)
+
+        logger.info(f"[cache] illust_detail {len(illust_dicts)} got, {changed} changed, "
+                    f"counters of {counter_changed} changed, {len(opt)} written")
+        if len(opt) != 0:
+            await self.mongo.db.illust_detail_cache.bulk_write(opt, ordered=False)
+
     async def illust_detail(self, illust_id: int) -> typing.Optional[Illust]:
+        illust = self._memory_get("illust_detail_cache", illust_id)
+        if illust is not None:
+            return illust
+
         cache = await self.mongo.db.illust_detail_cache.find_one({"illust.id": illust_id})
         if cache is not None:
-            return Illust.parse_obj(cache["illust"])
+            illust = Illust.parse_obj(cache["illust"])
+            self._memory_put("illust_detail_cache", illust_id, illust, cache.get("update_time"))
+            return self._mark_stale("illust_detail_cache", illust, cache.get("update_time"))
         else:
             return None
 
+    async def illust_details(self, illust_ids: typing.Iterable[int]) -> typing.Dict[int, Illust]:
+        """
+        批量读取缓存的插画详情（一次$in查询），返回的dict中只包含命中的项
+        """
+        memory = self._memory.get("illust_detail_cache")
+
+        result = {}
+        missing = []
+        for illust_id in illust_ids:
+            illust = memory.get(illust_id) if memory is not None else None
+            if illust is not None:
+                result[illust_id] = illust
+            else:
+                missing.append(illust_id)
+
+        if len(missing) != 0:
+            async for cache in self.mongo.db.illust_detail_cache.find({"illust.id": {"$in": missing}}):
+                illust = Illust.parse_obj(cache["illust"])
+                self._memory_put("illust_detail_cache", illust.id, illust, cache.get("update_time"))
+                result[illust.id] = illust
+
+        return result
+
     async def update_illust_detail(self, illust: Illust):
+        # 单个详情只在缓存未命中或过期时从远程获取，直接整个写入，不先读取比较
+        now = datetime.now()
+        illust_dict = illust.dict()
         await self.mongo.db.illust_detail_cache.update_one(
             {"illust.id": illust.id},
             {"$set": {
-                "illust": illust.dict(),
-                "update_time": datetime.now()
+                "illust": illust_dict,
+                "fingerprint": _illust_fingerprint(illust_dict),
+                "update_time": now
             }},
             upsert=True
         )
+        self._memory_put("illust_detail_cache", illust.id, illust, now)
 
     async def user_detail(self, user_id: int) -> typing.Optional[User]:
+        user = self._memory_get("user_detail_cache", user_id)
+        if user is not None:
+            return user
+
         cache = await self.mongo.db.user_detail_cache.find_one({"user.id": user_id})
         if cache is not None:
-            return User.parse_obj(cache["user"])
+            user = User.parse_obj(cache["user"])
+            self._memory_put("user_detail_cache", user_id, user, cache.get("update_time"))
+            return self._mark_stale("user_detail_cache", user, cache.get("update_time"))
         else:
             return None
 
     async def update_user_detail(self, user: User):
+        now = datetime.now()
         await self.mongo.db.user_detail_cache.update_one(
             {"user.id": user.id},
             {"$set": {
                 "user": user.dict(),
-                "update_time": datetime.now()
+                "update_time": now
             }},
             upsert=True
         )
+        self._memory_put("user_detail_cache", user.id, user, now)
 
     def search_illust(self, word: str, *, skip: int = 0, limit: int = 0):
         return self._make_illusts_cache_loader("search_illust_cache", "word", word, skip=skip, limit=limit)()
@@ -156,21 +366,26 @@ class LocalPixivRepo(AbstractPixivRepo):
         return self._make_illusts_cache_updater("search_illust_cache", "word", word)(content)
 
     async def search_user(self, word: str, *, skip: int = 0, limit: int = 0) -> typing.Optional[typing.List[User]]:
+        users = self._memory_get("search_user_cache", word)
+        if users is not None:
+            return do_skip_and_limit(users, skip, limit)
+
+        memory_enabled = "search_user_cache" in self._memory
         aggregation = [
             {
                 "$match": {"word": word}
             },
             {
-                "$replaceWith": {"user_id": "$user_id"}
+                "$replaceWith": {"user_id": "$user_id", "cache_update_time": "$update_time"}
             },
             {
                 "$unwind": "$user_id"
             },
         ]
 
-        if skip:
+        if skip and not memory_enabled:
             aggregation.append({"$skip": skip})
-        if limit:
+        if limit and not memory_enabled:
             aggregation.append({"$limit": limit})
 
         aggregation.extend([
@@ -191,21 +406,26 @@ class LocalPixivRepo(AbstractPixivRepo):
                 }
             },
             {
-                "$project": {"_id": 0, "user": 1, "user_id": 1}
+                "$project": {"_id": 0, "user": 1, "user_id": 1, "cache_update_time": 1}
             }
         ])
 
         result = self.mongo.db.search_user_cache.aggregate(aggregation)
 
         users = []
+        update_time = None
         async for x in result:
+            update_time = x.get("cache_update_time")
             if "user" in x and x["user"] is not None:
                 users.append(User.parse_obj(x["user"]))
             else:
                 users.append(User(id=x["user_id"], name="", account=""))
 
         if len(users) != 0:
-            return users
+            if memory_enabled:
+                self._memory_put("search_user_cache", word, users, update_time)
+                users = do_skip_and_limit(users, skip, limit)
+            return self._mark_stale("search_user_cache", users, update_time)
         else:
             return None
 
@@ -220,6 +440,8 @@ class LocalPixivRepo(AbstractPixivRepo):
             upsert=True
         )
 
+        self._memory_put("search_user_cache", word, content, now)
+
         opt = []
         for user in content:
             opt.append(UpdateOne(
@@ -264,26 +486,154 @@ class LocalPixivRepo(AbstractPixivRepo):
     def update_illust_ranking(self, mode: RankingMode, content: typing.List[typing.Union[Illust, LazyIllust]]):
         return self._make_illusts_cache_updater("other_cache", "type", mode.name + "_ranking")(content)
 
-    async def image(self, illust: Illust) -> typing.Optional[bytes]:
-        cache = await self.mongo.db.download_cache.find_one({"illust_id": illust.id})
-        if cache is not None:
-            return cache["content"]
-        else:
+    @staticmethod
+    def _image_key(illust: Illust, page: int, quantity: DownloadQuantity, profile: str) -> str:
+        return f"{illust.id}_p{page}_{quantity.name}_{profile}"
+
+    @staticmethod
+    def _image_query(illust: Illust, page: int, quantity: DownloadQuantity, profile: str) -> dict:
+        return {"illust_id": illust.id, "page": page, "quantity": quantity.name, "profile": profile}
+
+    async def image(self, illust: Illust, page: int = 0, *,
+                    quantity: DownloadQuantity, profile: str) -> typing.Optional[bytes]:
+        """
+        :param quantity: 图片尺寸
+        :param profile: 压缩配置的标识，见Compressor.profile
+        """
+        cache = await self.mongo.db.download_cache.find_one(self._image_query(illust, page, quantity, profile))
+        if cache is None:
             return None
 
-    async def update_image(self, illust: Illust, content: bytes):
+        content = await self.image_store.load(cache["key"])
+        if content is None:
+            # 元数据还在但图片已经不在了
+            await self.mongo.db.download_cache.delete_one({"_id": cache["_id"]})
+        else:
+            await self._touch_image(cache["_id"])
+        return content
+
+    async def _touch_image(self, _id: typing.Any):
+        # 记录访问时间及次数，用于过期清理及LRU/LFU淘汰
+        # 先记在内存中，由clean_image_cache批量写入，避免每次命中都写一次Mongo
+        access = self._image_access.get(_id)
+        if access is None:
+            self._image_access[_id] = [1, datetime.now()]
+        else:
+            access[0] += 1
+            access[1] = datetime.now()
+
+    async def _flush_image_access(self):
+        if len(self._image_access) == 0:
+            return
+
+        image_access, self._image_access = self._image_access, {}
+        opt = [UpdateOne({"_id": _id},
+                         {"$max": {"last_access_time": last_access_time},
+                          "$inc": {"access_count": count}})
+               for _id, (count, last_access_time) in image_access.items()]
+        await self.mongo.db.download_cache.bulk_write(opt, ordered=False)
+
+    async def _upsert_image_meta(self, illust: Illust, page: int, quantity: DownloadQuantity, profile: str,
+                                 key: str, size: int):
         now = datetime.now()
         await self.mongo.db.download_cache.update_one(
-            {"illust_id": illust.id},
-            {"$set": {
-                "content": bson.Binary(content),
-                "update_time": now
-            }},
+            self._image_query(illust, page, quantity, profile),
+            {
+                "$set": {
+                    "key": key,
+                    "size": size,
+                    "update_time": now,
+                    "last_access_time": now
+                },
+                # 写入即是因为被请求，计为一次访问，避免LFU下新图片总是最先被淘汰
+                "$setOnInsert": {"access_count": 1}
+            },
             upsert=True
         )
 
+    async def update_image(self, illust: Illust, page: int, quantity: DownloadQuantity, profile: str,
+                           content: bytes):
+        key = self._image_key(illust, page, quantity, profile)
+        await self.image_store.save(key, content)
+        await self._upsert_image_meta(illust, page, quantity, profile, key, len(content))
+
+    async def update_image_file(self, illust: Illust, page: int, quantity: DownloadQuantity, profile: str,
+                                path: typing.Union[str, os.PathLike]):
+        """
+        将本地文件中的图片写入缓存（文件会被移入ImageStore）
+        """
+        key = self._image_key(illust, page, quantity, profile)
+        size = os.path.getsize(path)
+        await self.image_store.save_file(key, path)
+        await self._upsert_image_meta(illust, page, quantity, profile, key, size)
+
+    async def _delete_image_cache(self, cache: dict):
+        # 先删除元数据，确认删除（期间没有被重新写入）后再删除图片
+        result = await self.mongo.db.download_cache.delete_one({"_id": cache["_id"],
+                                                                "update_time": cache["update_time"]})
+        if result.deleted_count != 0:
+            await self.image_store.delete(cache["key"])
+
+    async def clean_image_cache(self):
+        """
+        删除过期（超过pixiv_download_cache_expires_in未被访问）的图片及其元数据，
+        总大小超过pixiv_download_cache_max_bytes时再按LRU/LFU淘汰（图片不在Mongo中，不能依赖TTL索引）
+        """
+        await self._flush_image_access()
+
+        expired_before = datetime.fromtimestamp(time() - self._conf.pixiv_download_cache_expires_in)
+
+        cnt = 0
+        async for cache in self.mongo.db.download_cache.find({"$or": [
+            {"last_access_time": {"$lt": expired_before}},
+            {"last_access_time": {"$exists": False}, "update_time": {"$lt": expired_before}},
+        ]}):
+            await self._delete_image_cache(cache)
+            cnt += 1
+
+        if cnt != 0:
+            logger.info(f"[cache] {cnt} expired image(s) cleaned")
+
+        max_bytes = self._conf.pixiv_download_cache_max_bytes
+        if max_bytes:
+            await self._evict_image_cache(max_bytes)
+
+    async def _evict_image_cache(self, max_bytes: int):
+        # 按最新的访问记录淘汰
+        await self._flush_image_access()
+
+        total = 0
+        async for x in self.mongo.db.download_cache.aggregate([
+            {"$group": {"_id": None, "total": {"$sum": "$size"}}}
+        ]):
+            total = x["total"]
+
+        if total <= max_bytes:
+            return
+
+        if self._conf.pixiv_download_cache_eviction_policy == CacheEvictionPolicy.lfu:
+            sort = [("access_count", 1), ("last_access_time", 1)]
+        else:
+            sort = [("last_access_time", 1)]
+
+        cnt = 0
+        evicted_bytes = 0
+        async for cache in self.mongo.db.download_cache.find({}, sort=sort):
+            if total - evicted_bytes <= max_bytes:
+                break
+            await self._delete_image_cache(cache)
+            cnt += 1
+            evicted_bytes += cache.get("size", 0)
+
+        logger.info(f"[cache] {cnt} image(s) ({evicted_bytes} bytes) evicted, "
+                    f"{total - evicted_bytes}/{max_bytes} bytes used")
+
     async def invalidate_cache(self):
+        for memory in self._memory.values():
+            memory.clear()
+
         await self.mongo.db.download_cache.delete_many({})
+        await self.image_store.clear()
         await self.mongo.db.illust_detail_cache.delete_many({})
         await self.mongo.db.user_detail_cache.delete_many({})
         await self.mongo.db.illust_ranking_cache.delete_many({})
@@ -1,6 +1,21 @@
 import asyncio
 import typing
 
+from nonebot import logger
+
+from .utils import create_background_task
+
+T = typing.TypeVar("T")
+
+
+class StaleCache(typing.Generic[T]):
+    """
+    cache_loader返回StaleCache表示缓存已经过期但仍可使用：Mediator会立即返回其内容，并在后台刷新缓存
+    """
+
+    def __init__(self, content: T):
+        self.content = content
+
 
 class Mediator:
     def __init__(self, simultaneous_query: int = 4):
@@ -8,16 +23,22 @@ class Mediator:
             value=simultaneous_query)  # 用于限制从远程获取的并发量
         self._waiting = {}
 
-    T = typing.TypeVar("T")
-
     async def get(self, identifier: typing.Any,
                   cache_loader: typing.Callable[[], typing.Coroutine[typing.Any, typing.Any, T]],
                   remote_fetcher: typing.Callable[[], typing.Coroutine[typing.Any, typing.Any, T]],
                   cache_updater: typing.Callable[[T], typing.Coroutine[typing.Any, typing.Any, typing.NoReturn]],
                   hook_on_cache: typing.Optional[typing.Callable[[T], T]] = None,
                   hook_on_fetch: typing.Optional[typing.Callable[[T], T]] = None,
-                  timeout: typing.Optional[int] = 0) -> T:
-        cache = await cache_loader()
+                  timeout: typing.Optional[int] = 0,
+                  force_fetch: bool = False) -> T:
+        """
+        :param force_fetch: 为True时不读取缓存，直接从远程获取并更新缓存（用于预热）
+        """
+        cache = await cache_loader() if not force_fetch else None
+        if isinstance(cache, StaleCache):
+            cache = cache.content
+            self._revalidate(identifier, remote_fetcher, cache_updater, timeout)
+
         if cache is not None:
             if hook_on_cache:
                 cache = hook_on_cache(cache)
@@ -29,8 +50,8 @@ class Mediator:
         fut = asyncio.Future()
         self._waiting[identifier] = fut
         try:
-            asyncio.create_task(self._fetch(
-                fut, remote_fetcher, cache_updater, timeout))
+            create_background_task(self._fetch(fut, remote_fetcher, cache_updater, timeout),
+                                   f"fetch {identifier}")
             result = await fut
             if hook_on_fetch:
                 result = hook_on_fetch(result)
@@ -38,6 +59,26 @@ class Mediator:
         finally:
             await self._waiting.pop(identifier)
 
+    def _revalidate(self, identifier: typing.Any,
+                    remote_fetcher: typing.Callable[[], typing.Coroutine[typing.Any, typing.Any, T]],
+                    cache_updater: typing.Callable[[T], typing.Coroutine[typing.Any, typing.Any, typing.NoReturn]],
+                    timeout: typing.Optional[float] = None):
+        # 同一identifier同时只刷新一次（与正在进行的远程获取共用_waiting）
+        if identifier in self._waiting:
+            return
+
+        fut = asyncio.Future()
+        self._waiting[identifier] = fut
+
+        def on_done(f: asyncio.Future):
+            self._waiting.pop(identifier, None)
+            if not f.cancelled() and f.exception() is not None:
+                logger.opt(exception=f.exception()).error(f"failed to revalidate stale cache {identifier}")
+
+        fut.add_done_callback(on_done)
+        create_background_task(self._fetch(fut, remote_fetcher, cache_updater, timeout),
+                               f"revalidate {identifier}")
+
     async def _fetch(self, fut: asyncio.Future,
                      remote_fetcher: typing.Callable[[], typing.Coroutine[typing.Any, typing.Any, T]],
                      cache_updater: typing.Callable[[T], typing.Coroutine[typing.Any, typing.Any, typing.NoReturn]],
@@ -53,4 +94,4 @@ class Mediator:
             self._semaphore.release()
 
 
-__all__ = ("Mediator",)
+__all__ = ("Mediator", "StaleCache")
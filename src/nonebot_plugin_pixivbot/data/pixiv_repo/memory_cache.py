@@ -0,0 +1,68 @@
+import typing
+from collections import OrderedDict
+from datetime import datetime
+from time import time
+
+K = typing.TypeVar("K")
+V = typing.TypeVar("V")
+
+
+class MemoryCache(typing.Generic[K, V]):
+    """
+    进程内的LRU缓存，每个条目在写入Mongo的update_time + expires_in之后过期
+    """
+
+    def __init__(self, max_size: int, expires_in: int):
+        self.max_size = max_size
+        self.expires_in = expires_in
+
+        self._data: OrderedDict[K, typing.Tuple[V, float]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: K) -> typing.Optional[V]:
+        entry = self._data.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > time():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            else:
+                del self._data[key]
+
+        self.misses += 1
+        return None
+
+    def put(self, key: K, value: V, update_time: typing.Optional[datetime] = None):
+        if self.max_size <= 0:
+            return
+
+        if update_time is not None:
+            expires_at = update_time.timestamp() + self.expires_in
+        else:
+            expires_at = time() + self.expires_in
+
+        if expires_at <= time():
+            return
+
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: K):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __str__(self):
+        return f"{len(self._data)}/{self.max_size} items, {self.hits} hits, {self.misses} misses"
+
+
+__all__ = ("MemoryCache",)
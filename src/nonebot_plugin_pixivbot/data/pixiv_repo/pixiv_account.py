@@ -0,0 +1,110 @@
+from asyncio import sleep, create_task, CancelledError
+from time import monotonic
+from typing import Optional
+
+from nonebot import logger
+from pixivpy_async import *
+from pixivpy_async.error import TokenError
+
+from .rate_limiter import TokenBucket
+
+
+class PixivAccount:
+    """
+    一个Pixiv账号：各自持有AppPixivAPI、刷新access token的守护任务及API限流令牌桶
+    """
+
+    def __init__(self, index: int, refresh_token: str, proxy: Optional[str],
+                 api_rate_limit: float, api_rate_burst: int):
+        self.index = index
+        self.refresh_token = refresh_token
+        self.proxy = proxy
+
+        self.user_id = 0
+        self.api_bucket = TokenBucket(f"api#{index}", api_rate_limit, api_rate_burst)
+
+        # 正在进行的请求数，用于选择负载最小的账号
+        self.outstanding = 0
+        # 被限流后暂时不再使用该账号，直到该时间（monotonic）
+        self.ejected_until = 0.0
+        # 是否已成功刷新access token
+        self.authorized = False
+
+        self._pclient = None
+        self.papi: Optional[AppPixivAPI] = None
+        self._refresh_daemon_task = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.papi is not None and self.authorized and self.ejected_until <= monotonic()
+
+    def eject(self, seconds: float):
+        self.ejected_until = max(self.ejected_until, monotonic() + seconds)
+        logger.warning(f"[remote] account #{self.index} ejected for {seconds:.1f}s")
+
+    async def _refresh(self):
+        # Latest app version can be found using GET /old/application-info/android
+        USER_AGENT = "PixivAndroidApp/5.0.234 (Android 11; Pixel 5)"
+        # REDIRECT_URI = "https://app-api.pixiv.net/web/v1/users/auth/pixiv/callback"
+        # LOGIN_URL = "https://app-api.pixiv.net/web/v1/login"
+        AUTH_TOKEN_URL = "https://oauth.secure.pixiv.net/auth/token"
+        CLIENT_ID = "MOBrBDS8blbauoSck0ZfDbtuzpyT"
+        CLIENT_SECRET = "lsACyCD94FhDUtGTXi3QzcFE2uU1hqtDaKeqrdwj"
+
+        data = {
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "grant_type": "refresh_token",
+            "include_policy": "true",
+            "refresh_token": self.refresh_token,
+        }
+        result = await self.papi.requests_(method="POST", url=AUTH_TOKEN_URL, data=data,
+                                           headers={"User-Agent": USER_AGENT},
+                                           auth=False)
+        if result.has_error:
+            raise TokenError(None, result)
+        else:
+            self.papi.set_auth(result.access_token, result.refresh_token)
+            self.user_id = result["user"]["id"]
+            self.authorized = True
+
+            logger.success(
+                f"account #{self.index}: refresh access token successfully. "
+                f"new token expires in {result.expires_in} seconds.")
+            logger.info(f"access_token: {result.access_token}")
+            logger.info(f"refresh_token: {result.refresh_token}")
+
+            # maybe the refresh token will be changed (even thought i haven't seen it yet)
+            if result.refresh_token != self.refresh_token:
+                self.refresh_token = result.refresh_token
+                logger.warning(
+                    f"account #{self.index}: refresh token has been changed: {result.refresh_token}")
+
+            return result
+
+    async def _refresh_daemon(self):
+        while True:
+            try:
+                result = await self._refresh()
+                await sleep(result.expires_in * 0.8)
+            except CancelledError as e:
+                raise e
+            except Exception as e:
+                logger.error(
+                    f"account #{self.index}: failed to refresh access token, will retry in 60s.")
+                logger.exception(e)
+                self.eject(60)
+                await sleep(60)
+
+    def start(self):
+        self._pclient = PixivClient(proxy=self.proxy)
+        self.papi = AppPixivAPI(client=self._pclient.start())
+        self.papi.set_additional_headers({'Accept-Language': 'zh-CN'})
+        self._refresh_daemon_task = create_task(self._refresh_daemon())
+
+    async def shutdown(self):
+        await self._pclient.close()
+        self._refresh_daemon_task.cancel()
+
+
+__all__ = ("PixivAccount",)
@@ -0,0 +1,70 @@
+import asyncio
+from time import monotonic
+from typing import Optional
+
+from nonebot import logger
+
+
+class TokenBucket:
+    """
+    令牌桶限流：每秒补充rate个令牌，最多积攒capacity个（允许的突发量），rate为0时不限流
+    """
+
+    def __init__(self, name: str, rate: float, capacity: int):
+        self.name = name
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+
+        self._tokens = float(self.capacity)
+        self._last_refill = monotonic()
+        self._paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+        # 统计被限流（等待令牌或暂停）的总时长及次数
+        self.throttled_time = 0.0
+        self.throttled_count = 0
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def pause(self, seconds: float):
+        """
+        被远程限流时，在seconds秒内暂停发放令牌
+        """
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            waited = 0.0
+            while True:
+                now = monotonic()
+                if self._paused_until > now:
+                    delay = self._paused_until - now
+                elif self.rate <= 0:
+                    break
+                else:
+                    self._refill()
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+                    delay = (1 - self._tokens) / self.rate
+
+                await asyncio.sleep(delay)
+                waited += delay
+
+            if waited > 0:
+                self.throttled_time += waited
+                self.throttled_count += 1
+                logger.debug(f"[remote] throttled {waited:.2f}s by {self}")
+
+    def __str__(self):
+        return f"{self.name} bucket ({self.rate}/s, burst {self.capacity}): " \
+               f"throttled {self.throttled_count} times, {self.throttled_time:.2f}s in total"
+
+
+__all__ = ("TokenBucket",)
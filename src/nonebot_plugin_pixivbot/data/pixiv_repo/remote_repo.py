@@ -1,39 +1,69 @@
-from asyncio import sleep, create_task, CancelledError
-from functools import wraps
-from io import BytesIO
+import shutil
+from asyncio import sleep, create_task, Semaphore, gather, get_running_loop
+from functools import wraps, partial
+from hashlib import sha1
+from os import PathLike
+from pathlib import Path
+from random import uniform
 from sqlite3 import NotSupportedError
-from typing import TypeVar, Optional, Awaitable, List, Any, Callable, Union
+from time import time
+from typing import TypeVar, Optional, List, Any, Callable, Union, AsyncGenerator
 
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from nonebot import logger
 from pixivpy_async import *
-from pixivpy_async.error import TokenError
 
 from nonebot_plugin_pixivbot.config import Config
 from nonebot_plugin_pixivbot.enums import DownloadQuantity, RankingMode
 from nonebot_plugin_pixivbot.model import Illust, User
-from nonebot_plugin_pixivbot.utils.errors import QueryError
+from nonebot_plugin_pixivbot.utils.errors import QueryError, RateLimitError
 from .abstract_repo import AbstractPixivRepo
-from .compressor import Compressor
 from .lazy_illust import LazyIllust
 from .mediator import Mediator
+from .pixiv_account import PixivAccount
 from .pkg_context import context
+from .rate_limiter import TokenBucket
 from ..local_tag_repo import LocalTagRepo
 
 
+_RETRY_TIMES = 10
+_RETRY_BASE_DELAY = 0.5
+_RETRY_MAX_DELAY = 30
+# 部分下载的文件超过该时长未继续下载则删除（单位：秒）
+_PARTIAL_EXPIRES_IN = 3600 * 24
+# 被限流但服务器未给出Retry-After时，暂停发放令牌的时长（单位：秒）
+_RATE_LIMIT_PAUSE = 5
+# 结果与账号相关的接口（推荐、收藏），固定使用主账号，否则翻页时各页可能来自不同账号
+_PRIMARY_ACCOUNT_METHODS = {"illust_recommended", "user_bookmarks_illust"}
+
+
+def _backoff(attempt: int) -> float:
+    # 指数退避 + full jitter
+    return uniform(0, min(_RETRY_MAX_DELAY, _RETRY_BASE_DELAY * 2 ** attempt))
+
+
 def auto_retry(func):
     @wraps(func)
     async def wrapped(*args, **kwargs):
         err = None
-        for t in range(10):
+        for t in range(_RETRY_TIMES):
             try:
                 return await func(*args, **kwargs)
+            except RateLimitError as e:
+                delay = max(e.retry_after or 0, _backoff(t))
+                logger.warning(f"Rate limited, retrying in {delay:.1f}s... {t + 1}/{_RETRY_TIMES}")
+                err = e
             except QueryError as e:
                 raise e
             except Exception as e:
-                logger.info(f"Retrying... {t + 1}/10")
+                delay = _backoff(t)
+                logger.info(f"Retrying in {delay:.1f}s... {t + 1}/{_RETRY_TIMES}")
                 logger.exception(e)
                 err = e
 
+            if t + 1 < _RETRY_TIMES:
+                await sleep(delay)
+
         raise err
 
     return wrapped
@@ -41,6 +71,9 @@ def auto_retry(func):
 
 T = TypeVar("T")
 
+# 与AppPixivAPI.download相同，i.pximg.net要求带上Referer
+_DOWNLOAD_HEADERS = {"Referer": "https://app-api.pixiv.net/"}
+
 
 @context.register_singleton()
 class RemotePixivRepo(AbstractPixivRepo):
@@ -48,131 +81,219 @@ class RemotePixivRepo(AbstractPixivRepo):
 
     def __init__(self):
         self._local_tags = context.require(LocalTagRepo)
-        self._compressor = context.require(Compressor)
-
-        self._pclient = None
-        self._papi = None
-        self._refresh_daemon_task = None
 
-        self.user_id = 0
+        self._session = None
+        self._image_proxy = None
 
-        self.refresh_token = self._conf.pixiv_refresh_token
         self.simultaneous_query = self._conf.pixiv_simultaneous_query
+        self.simultaneous_page_query = self._conf.pixiv_simultaneous_page_query
         self.timeout = self._conf.pixiv_query_timeout
         self.proxy = self._conf.pixiv_proxy
 
         self._cache_manager = Mediator(
             simultaneous_query=self._conf.pixiv_simultaneous_query)
-
-    async def _refresh(self):
-        # Latest app version can be found using GET /old/application-info/android
-        USER_AGENT = "PixivAndroidApp/5.0.234 (Android 11; Pixel 5)"
-        # REDIRECT_URI = "https://app-api.pixiv.net/web/v1/users/auth/pixiv/callback"
-        # LOGIN_URL = "https://app-api.pixiv.net/web/v1/login"
-        AUTH_TOKEN_URL = "https://oauth.secure.pixiv.net/auth/token"
-        CLIENT_ID = "MOBrBDS8blbauoSck0ZfDbtuzpyT"
-        CLIENT_SECRET = "lsACyCD94FhDUtGTXi3QzcFE2uU1hqtDaKeqrdwj"
-
-        data = {
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET,
-            "grant_type": "refresh_token",
-            "include_policy": "true",
-            "refresh_token": self.refresh_token,
-        }
-        result = await self._papi.requests_(method="POST", url=AUTH_TOKEN_URL, data=data,
-                                            headers={"User-Agent": USER_AGENT},
-                                            auth=False)
-        if result.has_error:
-            raise TokenError(None, result)
-        else:
-            self._papi.set_auth(result.access_token, result.refresh_token)
-            self.user_id = result["user"]["id"]
-
-            logger.success(
-                f"refresh access token successfully. new token expires in {result.expires_in} seconds.")
-            logger.info(f"access_token: {result.access_token}")
-            logger.info(f"refresh_token: {result.refresh_token}")
-
-            # maybe the refresh token will be changed (even thought i haven't seen it yet)
-            if result.refresh_token != self.refresh_token:
-                self.refresh_token = result.refresh_token
-                logger.warning(
-                    f"refresh token has been changed: {result.refresh_token}")
-
-            return result
-
-    async def _refresh_daemon(self):
-        while True:
-            try:
-                result = await self._refresh()
-                await sleep(result.expires_in * 0.8)
-            except CancelledError as e:
-                raise e
-            except Exception as e:
-                logger.error(
-                    "failed to refresh access token, will retry in 60s.")
-                logger.exception(e)
-                await sleep(60)
+        self._page_semaphore = None
+
+        # 每个账号各自按pixiv_api_rate_limit限流，图片下载不需要登录，另外统一限流
+        refresh_tokens = [self._conf.pixiv_refresh_token, *self._conf.pixiv_refresh_tokens]
+        self.accounts = [
+            PixivAccount(i, token, self.proxy, self._conf.pixiv_api_rate_limit, self._conf.pixiv_api_rate_burst)
+            for i, token in enumerate(dict.fromkeys(x for x in refresh_tokens if x))
+        ]
+        self.image_bucket = TokenBucket("image", self._conf.pixiv_image_rate_limit,
+                                        self._conf.pixiv_image_rate_burst)
+
+    @property
+    def user_id(self) -> int:
+        # 以第一个账号作为主账号
+        return self.accounts[0].user_id
 
     async def start(self):
         self._cache_manager = Mediator(self.simultaneous_query)
-        self._pclient = PixivClient(proxy=self.proxy)
-        self._papi = AppPixivAPI(client=self._pclient.start())
-        self._papi.set_additional_headers({'Accept-Language': 'zh-CN'})
-        self._refresh_daemon_task = create_task(self._refresh_daemon())
+        self._page_semaphore = Semaphore(self.simultaneous_query)  # 用于限制翻页时的并发量
+        self._session = self._create_image_session()
+        for account in self.accounts:
+            account.start()
 
     async def shutdown(self):
-        await self._pclient.close()
-        self._refresh_daemon_task.cancel()
+        await self._session.close()
+        await gather(*[account.shutdown() for account in self.accounts])
+
+    def _create_image_session(self) -> ClientSession:
+        """
+        图片下载使用独立的连接池，避免大图下载占满API请求的连接
+        （aiohttp不支持HTTP/2，通过keep-alive复用连接）
+        """
+        kwargs = dict(limit=self._conf.pixiv_image_conn_limit,
+                      limit_per_host=self._conf.pixiv_image_conn_limit_per_host,
+                      keepalive_timeout=self._conf.pixiv_image_keepalive_timeout,
+                      ttl_dns_cache=self._conf.pixiv_image_dns_cache_ttl)
+
+        if self.proxy and self.proxy.startswith("socks"):
+            from aiohttp_socks import ProxyConnector
+            connector = ProxyConnector.from_url(self.proxy, **kwargs)
+        else:
+            connector = TCPConnector(**kwargs)
+            # http代理在每次请求时指定
+            self._image_proxy = self.proxy
+
+        # 大图下载的总时长不可预计，超时只针对连接及每次读取（即下载是否仍在进行）
+        return ClientSession(connector=connector,
+                             timeout=ClientTimeout(total=None, sock_connect=self.timeout,
+                                                   sock_read=self._conf.pixiv_download_read_timeout))
+
+    def _select_account(self, papi_method: str) -> PixivAccount:
+        """
+        与账号相关的接口固定使用主账号；其余接口选择正在进行的请求数最少的健康账号，没有健康账号时选择最早恢复的账号
+        """
+        if papi_method in _PRIMARY_ACCOUNT_METHODS:
+            return self.accounts[0]
+        return min(self.accounts, key=lambda x: (0, x.outstanding) if x.healthy else (1, x.ejected_until))
 
     @staticmethod
     def _check_error_in_raw_result(raw_result: dict):
         if "error" in raw_result:
+            if "rate limit" in (raw_result["error"]["message"] or "").lower():
+                raise RateLimitError()
             raise QueryError(raw_result["error"]["user_message"]
                              or raw_result["error"]["message"] or raw_result["error"]["reason"])
 
-    async def _flat_page(self, papi_search_func: Callable[..., Awaitable[dict]],
+    @staticmethod
+    def _parse_next_qs(raw_result: dict) -> Optional[dict]:
+        next_qs = AppPixivAPI.parse_qs(next_url=raw_result["next_url"])
+        if next_qs is not None and 'viewed' in next_qs:
+            # 由于pixivpy-async的illust_recommended的bug，需要删掉这个参数
+            del next_qs['viewed']
+        return next_qs
+
+    async def _call_api(self, papi_method: str, *args, **kwargs) -> dict:
+        """
+        选择一个账号，限流地调用其AppPixivAPI的papi_method方法并检查错误，
+        被限流时暂停该账号的API令牌发放，并暂时不再选择该账号
+        """
+        account = self._select_account(papi_method)
+        account.outstanding += 1
+        try:
+            await account.api_bucket.acquire()
+            raw_result = await getattr(account.papi, papi_method)(*args, **kwargs)
+        finally:
+            account.outstanding -= 1
+
+        try:
+            self._check_error_in_raw_result(raw_result)
+        except RateLimitError as e:
+            account.api_bucket.pause(_RATE_LIMIT_PAUSE)
+            if len(self.accounts) > 1:
+                account.eject(_RATE_LIMIT_PAUSE)
+            raise e
+        return raw_result
+
+    async def _fetch_page(self, papi_search_func: str, **kwargs) -> dict:
+        async with self._page_semaphore:
+            return await self._call_api(papi_search_func, **kwargs)
+
+    async def _iter_pages(self, papi_search_func: str,
+                          element_list_name: str,
+                          skip: int = 0,
+                          limit_page: int = 0,
+                          parallel: bool = False,
+                          **kwargs) -> AsyncGenerator[dict, None]:
+        """
+        按顺序逐页产出原始结果
+        :param parallel: 该接口的offset可预测时，根据第一页的大小计算之后每页的offset，并发获取后按顺序产出
+        """
+        # user_bookmarks_illust 没有offset参数
+        if skip:
+            raw_result = await self._fetch_page(papi_search_func, offset=skip, **kwargs)
+        else:
+            raw_result = await self._fetch_page(papi_search_func, **kwargs)
+
+        cur_page = 1
+        yield raw_result
+
+        next_qs = self._parse_next_qs(raw_result)
+        page_size = len(raw_result[element_list_name])
+
+        if parallel and self.simultaneous_page_query > 1 and next_qs is not None \
+                and "offset" in next_qs and page_size > 0:
+            offset = int(next_qs["offset"])
+            while not limit_page or cur_page < limit_page:
+                batch = self.simultaneous_page_query
+                if limit_page:
+                    batch = min(batch, limit_page - cur_page)
+
+                results = await gather(*[
+                    self._fetch_page(papi_search_func, **{**next_qs, "offset": offset + i * page_size})
+                    for i in range(batch)
+                ], return_exceptions=True)
+                offset += batch * page_size
+
+                # 按顺序产出，遇到最后一页即停止（越过最后一页的请求即使出错也忽略）
+                for raw_result in results:
+                    if isinstance(raw_result, BaseException):
+                        raise raw_result
+
+                    cur_page += 1
+                    yield raw_result
+
+                    if raw_result["next_url"] is None or len(raw_result[element_list_name]) == 0:
+                        return
+        else:
+            while next_qs is not None and (not limit_page or cur_page < limit_page):
+                raw_result = await self._fetch_page(papi_search_func, **next_qs)
+                cur_page += 1
+                yield raw_result
+
+                next_qs = self._parse_next_qs(raw_result)
+
+    async def _iter_flat_page(self, papi_search_func: str,
+                              element_list_name: str,
+                              element_mapper: Optional[Callable[[Any], T]] = None,
+                              element_filter: Optional[Callable[[T], bool]] = None,
+                              skip: int = 0,
+                              limit: int = 0,
+                              limit_page: int = 0,
+                              parallel: bool = False,
+                              **kwargs) -> AsyncGenerator[List[T], None]:
+        """
+        逐页产出经过映射与过滤的元素，总数不超过limit
+        """
+        total = 0
+
+        pages = self._iter_pages(papi_search_func, element_list_name, skip, limit_page, parallel, **kwargs)
+        try:
+            async for raw_result in pages:
+                items = []
+                for x in raw_result[element_list_name]:
+                    element = x
+                    if element_mapper is not None:
+                        element = element_mapper(x)
+                    if element_filter is None or element_filter(element):
+                        items.append(element)
+                        if limit and total + len(items) >= limit:
+                            break
+
+                total += len(items)
+                yield items
+
+                if limit and total >= limit:
+                    break
+        finally:
+            await pages.aclose()
+
+    async def _flat_page(self, papi_search_func: str,
                          element_list_name: str,
                          element_mapper: Optional[Callable[[Any], T]] = None,
                          element_filter: Optional[Callable[[T], bool]] = None,
                          skip: int = 0,
                          limit: int = 0,
                          limit_page: int = 0,
+                         parallel: bool = False,
                          **kwargs) -> List[T]:
-        cur_page = 0
         items = []
-
-        # user_bookmarks_illust 没有offset参数
-        if skip:
-            raw_result = await papi_search_func(offset=skip, **kwargs)
-        else:
-            raw_result = await papi_search_func(**kwargs)
-
-        self._check_error_in_raw_result(raw_result)
-
-        while (not limit or len(items) < limit) and (not limit_page or cur_page < limit_page):
-            for x in raw_result[element_list_name]:
-                element = x
-                if element_mapper is not None:
-                    element = element_mapper(x)
-                if element_filter is None or element_filter(element):
-                    items.append(element)
-                    if len(items) >= limit:
-                        break
-            else:
-                next_qs = AppPixivAPI.parse_qs(next_url=raw_result["next_url"])
-                if next_qs is None:
-                    break
-
-                if 'viewed' in next_qs:
-                    # 由于pixivpy-async的illust_recommended的bug，需要删掉这个参数
-                    del next_qs['viewed']
-
-                cur_page = cur_page + 1
-                raw_result = await papi_search_func(**next_qs)
-                self._check_error_in_raw_result(raw_result)
-
+        async for page in self._iter_flat_page(papi_search_func, element_list_name, element_mapper, element_filter,
+                                               skip, limit, limit_page, parallel, **kwargs):
+            items.extend(page)
         return items
 
     async def _add_to_local_tags(self, illusts: List[Union[LazyIllust, Illust]]):
@@ -191,7 +312,7 @@ class RemotePixivRepo(AbstractPixivRepo):
         except Exception as e:
             logger.exception(e)
 
-    async def _get_illusts(self, papi_search_func: Callable[[], Awaitable[dict]],
+    async def _get_illusts(self, papi_search_func: str,
                            element_list_name: str,
                            block_tags: Optional[List[str]],
                            min_bookmark: int = 0,
@@ -199,7 +320,13 @@ class RemotePixivRepo(AbstractPixivRepo):
                            skip: int = 0,
                            limit: int = 0,
                            limit_page: int = 0,
+                           parallel: bool = False,
+                           on_progress: Optional[Callable[[List[LazyIllust]], Any]] = None,
                            **kwargs):
+        """
+        :param on_progress: 每获取一页后以目前已获取的全部插画调用
+        """
+
         def illust_filter(illust: Illust) -> bool:
             # 标签过滤
             if block_tags is not None:
@@ -214,19 +341,21 @@ class RemotePixivRepo(AbstractPixivRepo):
                 return False
             return True
 
-        items = await self._flat_page(papi_search_func, element_list_name,
-                                      lambda x: Illust.parse_obj(x),
-                                      illust_filter, skip, limit, limit_page,
-                                      **kwargs)
-
         illusts = []
         detail_missing = 0
-        for x in items:
-            if "limit_unknown_360.png" in x.image_urls.large:
-                detail_missing += 1
-                illusts.append(LazyIllust(x.id))
-            else:
-                illusts.append(LazyIllust(x.id, x))
+        async for items in self._iter_flat_page(papi_search_func, element_list_name,
+                                                lambda x: Illust.parse_obj(x),
+                                                illust_filter, skip, limit, limit_page, parallel,
+                                                **kwargs):
+            for x in items:
+                if "limit_unknown_360.png" in x.image_urls.large:
+                    detail_missing += 1
+                    illusts.append(LazyIllust(x.id))
+                else:
+                    illusts.append(LazyIllust(x.id, x))
+
+            if on_progress is not None:
+                on_progress(illusts)
 
         logger.info(
             f"[remote] {len(illusts)} got, illust_detail of {detail_missing} are missed")
@@ -240,8 +369,7 @@ class RemotePixivRepo(AbstractPixivRepo):
     async def illust_detail(self, illust_id: int) -> Illust:
         logger.info(f"[remote] illust_detail {illust_id}")
 
-        raw_result = await self._papi.illust_detail(illust_id)
-        self._check_error_in_raw_result(raw_result)
+        raw_result = await self._call_api("illust_detail", illust_id)
         illust = Illust.parse_obj(raw_result["illust"])
 
         if self._conf.pixiv_tag_translation_enabled:
@@ -253,12 +381,12 @@ class RemotePixivRepo(AbstractPixivRepo):
     async def user_detail(self, user_id: int) -> User:
         logger.info(f"[remote] user_detail {user_id}")
 
-        raw_result = await self._papi.user_detail(user_id)
-        self._check_error_in_raw_result(raw_result)
+        raw_result = await self._call_api("user_detail", user_id)
         return User.parse_obj(raw_result["user"])
 
     @auto_retry
-    async def search_illust(self, word: str, *, skip: int = 0, limit: int = 0) -> List[LazyIllust]:
+    async def search_illust(self, word: str, *, skip: int = 0, limit: int = 0,
+                            on_progress: Optional[Callable[[List[LazyIllust]], Any]] = None) -> List[LazyIllust]:
         if not limit:
             limit = self._conf.pixiv_random_illust_max_item
         limit_page = self._conf.pixiv_random_illust_max_page
@@ -267,14 +395,14 @@ class RemotePixivRepo(AbstractPixivRepo):
         block_tags = self._conf.pixiv_block_tags
 
         logger.info(f"[remote] search_illust {word}")
-        return await self._get_illusts(self._papi.search_illust, "illusts",
+        return await self._get_illusts("search_illust", "illusts",
                                        block_tags, min_bookmark, min_view, skip, limit, limit_page,
-                                       word=word)
+                                       parallel=True, on_progress=on_progress, word=word)
 
     @auto_retry
     async def search_user(self, word: str, *, skip: int = 0, limit: int = 20) -> List[User]:
         logger.info(f"[remote] search_user {word}")
-        content = await self._flat_page(self._papi.search_user, "user_previews",
+        content = await self._flat_page("search_user", "user_previews",
                                         lambda x: User.parse_obj(
                                             x["user"]), None,
                                         skip, limit, 1,
@@ -295,9 +423,9 @@ class RemotePixivRepo(AbstractPixivRepo):
         block_tags = self._conf.pixiv_block_tags
 
         logger.info(f"[remote] user_illusts {user_id}")
-        return await self._get_illusts(self._papi.user_illusts, "illusts",
+        return await self._get_illusts("user_illusts", "illusts",
                                        block_tags, min_bookmark, min_view, skip, limit, limit_page,
-                                       user_id=user_id)
+                                       parallel=True, user_id=user_id)
 
     @auto_retry
     async def user_bookmarks(self, user_id: int = 0, *, skip: int = 0, limit: int = 0) -> List[LazyIllust]:
@@ -316,7 +444,7 @@ class RemotePixivRepo(AbstractPixivRepo):
         block_tags = self._conf.pixiv_block_tags
 
         logger.info(f"[remote] user_bookmarks {user_id}")
-        return await self._get_illusts(self._papi.user_bookmarks_illust, "illusts",
+        return await self._get_illusts("user_bookmarks_illust", "illusts",
                                        block_tags, min_bookmark, min_view, skip, limit, limit_page,
                                        user_id=user_id)
 
@@ -331,7 +459,7 @@ class RemotePixivRepo(AbstractPixivRepo):
         block_tags = self._conf.pixiv_block_tags
 
         logger.info(f"[remote] recommended_illusts")
-        return await self._get_illusts(self._papi.illust_recommended, "illusts",
+        return await self._get_illusts("illust_recommended", "illusts",
                                        block_tags, min_bookmark, min_view, skip, limit, limit_page)
 
     @auto_retry
@@ -345,7 +473,7 @@ class RemotePixivRepo(AbstractPixivRepo):
         block_tags = self._conf.pixiv_block_tags
 
         logger.info(f"[remote] related_illusts {illust_id}")
-        return await self._get_illusts(self._papi.illust_related, "illusts",
+        return await self._get_illusts("illust_related", "illusts",
                                        block_tags, min_bookmark, min_view, skip, limit, limit_page,
                                        illust_id=illust_id)
 
@@ -358,28 +486,118 @@ class RemotePixivRepo(AbstractPixivRepo):
         block_tags = self._conf.pixiv_block_tags
 
         logger.info(f"[remote] illust_ranking {mode}")
-        return await self._get_illusts(self._papi.illust_ranking, "illusts",
+        return await self._get_illusts("illust_ranking", "illusts",
                                        block_tags, 0, 0, skip, limit, 0,
-                                       mode=mode.name)
+                                       parallel=True, mode=mode.name)
 
-    @auto_retry
-    async def image(self, illust: Illust) -> bytes:
-        download_quantity = self._conf.pixiv_download_quantity
+    def _image_url(self, illust: Illust, page: int, quantity: Optional[DownloadQuantity]) -> str:
+        download_quantity = quantity or self._conf.pixiv_download_quantity
         custom_domain = self._conf.pixiv_download_custom_domain
 
-        if download_quantity == DownloadQuantity.original:
-            if len(illust.meta_pages) > 0:
-                url = illust.meta_pages[0].image_urls.original
-            else:
-                url = illust.meta_single_page.original_image_url
+        if len(illust.meta_pages) > 0:
+            url = illust.meta_pages[page].image_urls.__getattribute__(download_quantity.name)
+        elif download_quantity == DownloadQuantity.original:
+            url = illust.meta_single_page.original_image_url
         else:
             url = illust.image_urls.__getattribute__(download_quantity.name)
 
         if custom_domain is not None:
             url = url.replace("i.pximg.net", custom_domain)
+        return url
 
-        with BytesIO() as bio:
-            await self._papi.download(url, fname=bio)
-            content = bio.getvalue()
-            content = await self._compressor.compress(content)
-            return content
+    def _check_image_response(self, resp):
+        if resp.status == 429:
+            retry_after = resp.headers.get("Retry-After")
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None
+
+            self.image_bucket.pause(retry_after or _RATE_LIMIT_PAUSE)
+            raise RateLimitError(retry_after=retry_after)
+        if 400 <= resp.status < 500 and resp.status not in (408, 416):
+            # 404、403等错误重试也不会成功，直接失败而不占用下载的名额
+            raise QueryError(f"图片下载失败（HTTP {resp.status}）")
+        resp.raise_for_status()
+
+    @auto_retry
+    async def image(self, illust: Illust, page: int = 0, *,
+                    quantity: Optional[DownloadQuantity] = None) -> bytes:
+        """
+        下载图片原始内容（不经过压缩）
+        :param quantity: 下载的尺寸，为None时使用pixiv_download_quantity
+        """
+        url = self._image_url(illust, page, quantity)
+        await self.image_bucket.acquire()
+        async with self._session.get(url, headers=_DOWNLOAD_HEADERS, proxy=self._image_proxy) as resp:
+            self._check_image_response(resp)
+            return await resp.read()
+
+    def _partial_path(self, url: str) -> Path:
+        return Path(self._conf.pixiv_download_partial_path) / (sha1(url.encode()).hexdigest() + ".part")
+
+    @staticmethod
+    def _content_range_start(resp) -> Optional[int]:
+        # Content-Range: bytes <start>-<end>/<size>
+        content_range = resp.headers.get("Content-Range", "")
+        try:
+            return int(content_range.split(" ")[1].split("-")[0])
+        except (IndexError, ValueError):
+            return None
+
+    @auto_retry
+    async def image_to_file(self, illust: Illust, page: int = 0, *,
+                            quantity: Optional[DownloadQuantity] = None,
+                            path: Union[str, PathLike],
+                            chunk_size: int = 64 * 1024):
+        """
+        将图片原始内容分块写入文件，不在内存中保留整张图片。
+        下载中的内容保存在pixiv_download_partial_path，中断后（包括重试及下一次请求）通过Range从已下载的位置继续
+        :param quantity: 下载的尺寸，为None时使用pixiv_download_quantity
+        """
+        url = self._image_url(illust, page, quantity)
+        partial_path = self._partial_path(url)
+        loop = get_running_loop()
+
+        await loop.run_in_executor(None, partial(partial_path.parent.mkdir, parents=True, exist_ok=True))
+        offset = partial_path.stat().st_size if partial_path.exists() else 0
+
+        headers = _DOWNLOAD_HEADERS
+        if offset:
+            headers = {**headers, "Range": f"bytes={offset}-"}
+
+        await self.image_bucket.acquire()
+        async with self._session.get(url, headers=headers, proxy=self._image_proxy) as resp:
+            if resp.status == 416:
+                # 已下载的部分不可用，下一次重试时从头下载
+                partial_path.unlink(missing_ok=True)
+            self._check_image_response(resp)
+
+            if offset and resp.status == 206 and self._content_range_start(resp) == offset:
+                logger.info(f"[remote] resume downloading {url} from {offset} bytes")
+                mode = "ab"
+            else:
+                mode = "wb"
+
+            with open(partial_path, mode) as f:
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    await loop.run_in_executor(None, f.write, chunk)
+
+        await loop.run_in_executor(None, shutil.move, partial_path, path)
+
+    def clean_partial_downloads(self):
+        """
+        删除长时间未继续下载的部分文件
+        """
+        expired_before = time() - _PARTIAL_EXPIRES_IN
+        root = Path(self._conf.pixiv_download_partial_path)
+        if not root.exists():
+            return
+
+        # *.tmp为PixivRepo下载原图时的临时文件，进程中断时可能残留
+        for x in [*root.glob("*.part"), *root.glob("*.tmp")]:
+            try:
+                if x.stat().st_mtime < expired_before:
+                    x.unlink()
+            except FileNotFoundError:
+                pass
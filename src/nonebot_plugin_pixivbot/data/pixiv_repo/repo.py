@@ -1,52 +1,106 @@
+import asyncio
+import os
+import tempfile
 import typing
 from functools import partial
+from pathlib import Path
+
+from nonebot import logger
 
 from nonebot_plugin_pixivbot.config import Config
-from nonebot_plugin_pixivbot.enums import RankingMode
+from nonebot_plugin_pixivbot.enums import RankingMode, DownloadQuantity
 from nonebot_plugin_pixivbot.model import Illust, User
+from nonebot_plugin_pixivbot.utils.errors import BadRequestError
 from .abstract_repo import AbstractPixivRepo
+from .compressor import Compressor
 from .lazy_illust import LazyIllust
 from .local_repo import LocalPixivRepo
 from .mediator import Mediator
 from .pkg_context import context
 from .remote_repo import RemotePixivRepo
+from .utils import do_skip_and_limit, create_background_task
 from ...utils.lifecycler import on_startup, on_shutdown
 
 
-def do_skip_and_limit(items: list, skip: int, limit: int) -> list:
-    if skip:
-        if limit and len(items) > skip + limit:
-            return items[skip:skip + limit]
-        else:
-            return items[skip:]
-    elif limit and len(items) > limit:
-        return items[:limit]
-    else:
-        return items
-
-
 @context.root.register_singleton()
 class PixivRepo(AbstractPixivRepo):
     _conf: Config = context.require(Config)
 
     def __init__(self):
         self._mediator = None
+        self._image_mediator = None
+        self._clean_daemon_task = None
         self.remote = context.require(RemotePixivRepo)
         self.cache = context.require(LocalPixivRepo)
+        self.compressor = context.require(Compressor)
 
         on_startup(self.start, replay=True)
         on_shutdown(self.shutdown)
 
+    async def _clean_daemon(self):
+        while True:
+            try:
+                await self.cache.clean_image_cache()
+                await asyncio.get_running_loop().run_in_executor(None, self.remote.clean_partial_downloads)
+            except asyncio.CancelledError as e:
+                raise e
+            except Exception as e:
+                logger.error("failed to clean image cache.")
+                logger.exception(e)
+            await asyncio.sleep(self._conf.pixiv_download_cache_clean_interval)
+
     async def start(self):
         await self.remote.start()
-        self._mediator = Mediator()
+        self._mediator = Mediator(self._conf.pixiv_simultaneous_query)
+        self._image_mediator = Mediator(self._conf.pixiv_simultaneous_download)
+        self._clean_daemon_task = asyncio.create_task(self._clean_daemon())
 
     async def shutdown(self):
         await self.remote.shutdown()
+        self._clean_daemon_task.cancel()
 
     def invalidate_cache(self):
         return self.cache.invalidate_cache()
 
+    async def _fill_illust_details(self, illusts: typing.List[LazyIllust],
+                                   cache_updater: typing.Callable[[typing.List[LazyIllust]], typing.Awaitable]):
+        """
+        为缺失详情的LazyIllust（远程返回limit_unknown_360.png占位图的项）补全详情：
+        先对缓存做一次批量查询，剩余的通过illust_detail（由Mediator去重及限制并发）获取，补全后重新写入列表缓存
+        """
+        missing: typing.Dict[int, typing.List[LazyIllust]] = {}
+        for x in illusts:
+            if not x.loaded:
+                missing.setdefault(x.id, []).append(x)
+
+        if len(missing) == 0:
+            return
+
+        for illust_id, illust in (await self.cache.illust_details(missing.keys())).items():
+            for x in missing.pop(illust_id):
+                x.content = illust
+
+        results = await asyncio.gather(*[self.illust_detail(illust_id) for illust_id in missing],
+                                       return_exceptions=True)
+        for illust_id, result in zip(missing, results):
+            if isinstance(result, Exception):
+                logger.warning(f"failed to fill illust_detail of {illust_id}: {result}")
+            else:
+                for x in missing[illust_id]:
+                    x.content = result
+
+        logger.info(f"[remote] illust_detail of {sum(1 for x in illusts if x.loaded)}/{len(illusts)} are available")
+        await cache_updater(illusts)
+
+    def _with_illust_details(self, cache_updater: typing.Callable[[typing.List[LazyIllust]], typing.Awaitable]):
+        # 先写入列表缓存，再在后台补全缺失的详情（不占用列表的超时时间，补全失败也不影响列表）
+        async def updater(illusts: typing.List[LazyIllust]):
+            await cache_updater(illusts)
+            if not all(x.loaded for x in illusts):
+                create_background_task(self._fill_illust_details(illusts, cache_updater), "fill illust details")
+
+        return updater
+
     async def illust_detail(self, illust_id: int) -> Illust:
         return await self._mediator.get(
             identifier=(6, illust_id),
@@ -58,6 +112,20 @@ class PixivRepo(AbstractPixivRepo):
             timeout=self._conf.pixiv_query_timeout
         )
 
+    async def illust_details(self, illust_ids: typing.Sequence[int]) -> typing.List[Illust]:
+        """
+        批量获取插画详情：缓存中的通过一次$in查询读取，其余的并发从远程获取（并发量及去重由Mediator控制）
+        :return: 与illust_ids顺序对应的插画详情
+        """
+        illusts = await self.cache.illust_details(illust_ids)
+
+        missing = [x for x in dict.fromkeys(illust_ids) if x not in illusts]
+        if len(missing) != 0:
+            fetched = await asyncio.gather(*[self.illust_detail(x) for x in missing])
+            illusts.update(zip(missing, fetched))
+
+        return [illusts[x] for x in illust_ids]
+
     async def user_detail(self, user_id: int) -> User:
         return await self._mediator.get(
             identifier=(9, user_id),
@@ -69,20 +137,55 @@ class PixivRepo(AbstractPixivRepo):
             timeout=self._conf.pixiv_query_timeout
         )
 
-    async def search_illust(self, word: str, *, skip: int = 0, limit: int = 0) -> typing.List[LazyIllust]:
+    async def search_illust(self, word: str, *, skip: int = 0, limit: int = 0,
+                            eager_item: int = 0) -> typing.List[LazyIllust]:
+        """
+        :param eager_item: 大于0时，若需要从远程获取，则一旦获取到至少eager_item项就先返回已获取的部分，
+        剩余的页在后台继续获取并写入缓存
+        """
+        partial_result = None
+        if eager_item:
+            partial_result = asyncio.get_running_loop().create_future()
+
+            def on_progress(illusts: typing.List[LazyIllust]):
+                if not partial_result.done() and len(illusts) >= eager_item:
+                    partial_result.set_result(list(illusts))
+
+            remote_fetcher = partial(self.remote.search_illust, word=word, on_progress=on_progress)
+        else:
+            remote_fetcher = partial(self.remote.search_illust, word=word)
+
         # skip和limit只作用于cache_loader
-        return await self._mediator.get(
+        result = self._mediator.get(
             identifier=(0, word),
             cache_loader=partial(self.cache.search_illust,
                                  word=word, skip=skip, limit=limit),
-            remote_fetcher=partial(self.remote.search_illust, word=word),
-            cache_updater=lambda content: self.cache.update_search_illust(
-                word, content),
+            remote_fetcher=remote_fetcher,
+            cache_updater=self._with_illust_details(lambda content: self.cache.update_search_illust(
+                word, content)),
             hook_on_fetch=lambda result: do_skip_and_limit(
                 result, skip, limit),
             timeout=self._conf.pixiv_query_timeout
         )
 
+        if partial_result is None:
+            return await result
+        else:
+            return await self._get_eagerly(result, partial_result, skip, limit)
+
+    @staticmethod
+    async def _get_eagerly(result: typing.Awaitable[typing.List[LazyIllust]],
+                           partial_result: asyncio.Future,
+                           skip: int, limit: int) -> typing.List[LazyIllust]:
+        task = create_background_task(result, "fetch remaining pages in background")
+        await asyncio.wait([task, partial_result], return_when=asyncio.FIRST_COMPLETED)
+
+        if task.done():
+            partial_result.cancel()
+            return task.result()
+
+        return do_skip_and_limit(partial_result.result(), skip, limit)
+
     async def search_user(self, word: str, *, skip: int = 0, limit: int = 0) -> typing.List[User]:
         return await self._mediator.get(
             identifier=(1, word),
@@ -102,8 +205,8 @@ class PixivRepo(AbstractPixivRepo):
             cache_loader=partial(self.cache.user_illusts,
                                  user_id=user_id, skip=skip, limit=limit),
             remote_fetcher=partial(self.remote.user_illusts, user_id=user_id),
-            cache_updater=lambda content: self.cache.update_user_illusts(
-                user_id, content),
+            cache_updater=self._with_illust_details(lambda content: self.cache.update_user_illusts(
+                user_id, content)),
             hook_on_fetch=lambda result: do_skip_and_limit(
                 result, skip, limit),
             timeout=self._conf.pixiv_query_timeout
@@ -116,8 +219,8 @@ class PixivRepo(AbstractPixivRepo):
                                  user_id=user_id, skip=skip, limit=limit),
             remote_fetcher=partial(
                 self.remote.user_bookmarks, user_id=user_id),
-            cache_updater=lambda content: self.cache.update_user_bookmarks(
-                user_id, content),
+            cache_updater=self._with_illust_details(lambda content: self.cache.update_user_bookmarks(
+                user_id, content)),
             hook_on_fetch=lambda result: do_skip_and_limit(
                 result, skip, limit),
             timeout=self._conf.pixiv_query_timeout
@@ -129,7 +232,7 @@ class PixivRepo(AbstractPixivRepo):
             cache_loader=partial(
                 self.cache.recommended_illusts, skip=skip, limit=limit),
             remote_fetcher=self.remote.recommended_illusts,
-            cache_updater=self.cache.update_recommended_illusts,
+            cache_updater=self._with_illust_details(self.cache.update_recommended_illusts),
             hook_on_fetch=lambda result: do_skip_and_limit(
                 result, skip, limit),
             timeout=self._conf.pixiv_query_timeout
@@ -142,37 +245,129 @@ class PixivRepo(AbstractPixivRepo):
                 self.cache.related_illusts, illust_id=illust_id, skip=skip, limit=limit),
             remote_fetcher=partial(
                 self.remote.related_illusts, illust_id=illust_id),
-            cache_updater=lambda content: self.cache.update_related_illusts(
-                illust_id, content),
+            cache_updater=self._with_illust_details(lambda content: self.cache.update_related_illusts(
+                illust_id, content)),
             hook_on_fetch=lambda result: do_skip_and_limit(
                 result, skip, limit),
             timeout=self._conf.pixiv_query_timeout
         )
 
     async def illust_ranking(self, mode: RankingMode = RankingMode.day,
-                             *, skip: int = 0, limit: int = 0) -> typing.List[LazyIllust]:
+                             *, skip: int = 0, limit: int = 0,
+                             force_fetch: bool = False) -> typing.List[LazyIllust]:
+        """
+        :param force_fetch: 为True时忽略缓存，从远程获取并更新缓存
+        """
         return await self._mediator.get(
             identifier=(5, mode),
             cache_loader=partial(
                 self.cache.illust_ranking, mode=mode, skip=skip, limit=limit),
             remote_fetcher=partial(
                 self.remote.illust_ranking, mode=mode),
-            cache_updater=lambda content: self.cache.update_illust_ranking(
-                mode, content),
+            cache_updater=self._with_illust_details(lambda content: self.cache.update_illust_ranking(
+                mode, content)),
             hook_on_fetch=lambda result: do_skip_and_limit(
                 result, skip, limit),
-            timeout=self._conf.pixiv_query_timeout
+            timeout=self._conf.pixiv_query_timeout,
+            force_fetch=force_fetch
         )
 
-    async def image(self, illust: Illust) -> bytes:
-        return await self._mediator.get(
-            identifier=(7, illust.id),
-            cache_loader=partial(self.cache.image, illust=illust),
-            remote_fetcher=partial(self.remote.image, illust=illust),
-            cache_updater=lambda content: self.cache.update_image(
-                illust, content),
-            timeout=self._conf.pixiv_query_timeout
+    async def image(self, illust: Illust, page: int = 0) -> bytes:
+        quantity = self._conf.pixiv_download_quantity
+        profile = self.compressor.profile
+        return await self._image_mediator.get(
+            identifier=(7, illust.id, page, quantity, profile),
+            cache_loader=partial(self.cache.image, illust=illust, page=page,
+                                 quantity=quantity, profile=profile),
+            remote_fetcher=partial(self._fetch_image, illust=illust, page=page,
+                                   quantity=quantity, profile=profile),
+            # _fetch_image已将图片写入缓存（未压缩的原图直接移入ImageStore，不必读出后再写入一遍）
+            cache_updater=self._image_cached,
+            # 下载的总时长由_fetch_image_queued限制（排队等待压缩的时间不计入）
+            timeout=None
         )
 
+    async def images(self, illust: Illust, pages: typing.Optional[typing.Sequence[int]] = None) -> typing.List[bytes]:
+        """
+        并发获取多页插画的多个页面（每页分别缓存及压缩）
+        :param pages: 要获取的页，为None时获取前pixiv_download_max_page页
+        :return: 按pages顺序排列的图片（获取失败的页被跳过，全部失败时抛出第一页的异常）
+        """
+        page_count = max(illust.page_count, 1)
+        if pages is None:
+            pages = range(min(page_count, self._conf.pixiv_download_max_page))
+        else:
+            for page in pages:
+                if not 0 <= page < page_count:
+                    raise BadRequestError(f"插画{illust.id}只有{page_count}页")
+        results = await asyncio.gather(*[self.image(illust, page) for page in pages], return_exceptions=True)
+
+        images = []
+        error = None
+        for page, result in zip(pages, results):
+            if isinstance(result, Exception):
+                logger.warning(f"failed to get image {illust.id}_p{page}: {type(result).__name__} {result}")
+                error = error or result
+            else:
+                images.append(result)
+
+        if not images and error is not None:
+            raise error
+        return images
+
+    @staticmethod
+    async def _image_cached(content: bytes):
+        pass
+
+    async def _fetch_image(self, illust: Illust, page: int, quantity: DownloadQuantity, profile: str) -> bytes:
+        """
+        缓存中没有所需的图片时：若缓存有未压缩的原图则由其派生，否则从远程下载（下载原图时同时缓存未压缩的原图），
+        得到的图片写入缓存
+        """
+        # 在下载或读取图片之前获取Compressor的队列，排队中的请求不持有图片
+        async with self.compressor.queue:
+            return await self._fetch_image_queued(illust, page, quantity, profile)
+
+    async def _fetch_image_queued(self, illust: Illust, page: int, quantity: DownloadQuantity, profile: str) -> bytes:
+        is_raw_original = quantity == DownloadQuantity.original and profile == Compressor.RAW_PROFILE
+
+        if not is_raw_original:
+            original = await self.cache.image(illust, page, quantity=DownloadQuantity.original,
+                                              profile=Compressor.RAW_PROFILE)
+            if original is not None:
+                logger.info(f"[cache] image {illust.id}_p{page} ({quantity.name}, {profile}) derived from original")
+                content = await self.compressor.derive(original, quantity)
+                await self.cache.update_image(illust, page, quantity, profile, content)
+                return content
+
+        if quantity != DownloadQuantity.original:
+            content = await asyncio.wait_for(self.remote.image(illust, page, quantity=quantity),
+                                             self._conf.pixiv_download_timeout)
+            content = await self.compressor.compress(content)
+            await self.cache.update_image(illust, page, quantity, profile, content)
+            return content
+
+        # 原图可能很大，分块下载到临时文件（中断后可断点续传），由Compressor直接从文件读取
+        # 临时文件与部分下载的文件放在同一目录，以便直接移入ImageStore
+        tmp_dir = Path(self._conf.pixiv_download_partial_path)
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=tmp_dir)
+        os.close(fd)
+        try:
+            await asyncio.wait_for(self.remote.image_to_file(illust, page, quantity=quantity, path=tmp_path),
+                                   self._conf.pixiv_download_timeout)
+            content = await self.compressor.compress(tmp_path)
+            if is_raw_original:
+                # 未压缩时content即原图，将下载的文件移入ImageStore
+                await self.cache.update_image_file(illust, page, quantity, profile, tmp_path)
+            else:
+                if self._conf.pixiv_download_cache_keep_original:
+                    await self.cache.update_image_file(illust, page, quantity, Compressor.RAW_PROFILE, tmp_path)
+                await self.cache.update_image(illust, page, quantity, profile, content)
+            return content
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
 
 __all__ = ('PixivRepo',)
@@ -0,0 +1,38 @@
+import asyncio
+import typing
+
+from nonebot import logger
+
+_background_tasks: typing.Set[asyncio.Task] = set()
+
+
+def do_skip_and_limit(items: list, skip: int, limit: int) -> list:
+    if skip:
+        if limit and len(items) > skip + limit:
+            return items[skip:skip + limit]
+        else:
+            return items[skip:]
+    elif limit and len(items) > limit:
+        return items[:limit]
+    else:
+        return items
+
+
+def create_background_task(coro: typing.Coroutine, description: str) -> asyncio.Task:
+    """
+    在后台运行coro：保留任务的引用直到完成（避免被回收），并记录其抛出的异常
+    :param description: 出错时日志中描述该任务的文字
+    """
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+
+    def on_done(t: asyncio.Task):
+        _background_tasks.discard(t)
+        if not t.cancelled() and t.exception() is not None:
+            logger.opt(exception=t.exception()).error(f"failed to {description}")
+
+    task.add_done_callback(on_done)
+    return task
+
+
+__all__ = ("do_skip_and_limit", "create_background_task",)
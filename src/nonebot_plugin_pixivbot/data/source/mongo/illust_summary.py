@@ -0,0 +1,89 @@
+import typing
+from datetime import datetime, timezone
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+# 列表缓存文档中内嵌的插画摘要的格式版本，摘要的字段变化时递增，旧版本的摘要会在读取时于后台重建。
+# 版本只表示格式，不表示内容是否最新：摘要中的计数等在列表从远程重新获取（或补全缺失的详情）后随列表一起重写，
+# 生成时间（summary_time）超过插画详情过期时间的一半时也会在读取时于后台重建
+ILLUST_SUMMARY_VERSION = 1
+
+
+def summarize_illust(illust: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    """
+    由插画详情（Illust.dict()或illust_detail_cache中的illust字段）生成抽选所需的摘要
+    """
+    create_date: datetime = illust["create_date"]
+    if create_date.tzinfo is None:
+        # pymongo读出的是不带时区的UTC时间
+        create_date = create_date.replace(tzinfo=timezone.utc)
+
+    tags = []
+    for t in illust["tags"]:
+        tags.append(t["name"])
+        if t.get("translated_name"):
+            tags.append(t["translated_name"])
+
+    return {
+        "id": illust["id"],
+        "total_bookmarks": illust["total_bookmarks"],
+        "total_view": illust["total_view"],
+        "create_timestamp": create_date.timestamp(),
+        "tags": tags,
+    }
+
+
+async def aggregate_list_summaries(db: AsyncIOMotorDatabase, collection_name: str,
+                                   query: typing.Dict[str, typing.Any]) \
+        -> typing.Dict[typing.Any, typing.List[typing.Dict[str, typing.Any]]]:
+    """
+    为列表缓存中符合query的文档生成摘要：$lookup插画详情并只投影摘要所需的字段，缺少详情的项的摘要只含id
+    :return: 文档的_id -> 与其illust_id顺序对应的摘要
+    """
+    aggregation = [
+        {
+            "$match": query
+        },
+        {
+            "$project": {"illust_id": 1}
+        },
+        {
+            "$unwind": "$illust_id"
+        },
+        {
+            "$lookup": {
+                "from": "illust_detail_cache",
+                "localField": "illust_id",
+                "foreignField": "illust.id",
+                "as": "illusts"
+            }
+        },
+        {
+            "$project": {
+                "illust_id": 1,
+                "illust": {"$arrayElemAt": ["$illusts.illust", 0]}
+            }
+        },
+        {
+            "$project": {
+                "illust_id": 1,
+                "id": "$illust.id",
+                "total_bookmarks": "$illust.total_bookmarks",
+                "total_view": "$illust.total_view",
+                "create_date": "$illust.create_date",
+                "tags": "$illust.tags"
+            }
+        }
+    ]
+
+    result = {}
+    async for x in db[collection_name].aggregate(aggregation):
+        summaries = result.setdefault(x["_id"], [])
+        if "total_bookmarks" in x:
+            summaries.append(summarize_illust(x))
+        else:
+            summaries.append({"id": x["illust_id"]})
+    return result
+
+
+__all__ = ("ILLUST_SUMMARY_VERSION", "summarize_illust", "aggregate_list_summaries",)
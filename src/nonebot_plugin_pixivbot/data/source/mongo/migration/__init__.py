@@ -1,4 +1,7 @@
 from nonebot_plugin_pixivbot.data.source.mongo.migration.mongo_migration_manager import MongoMigrationManager
 from .mongo_v1_to_v2 import *
+from .mongo_v2_to_v3 import *
+from .mongo_v3_to_v4 import *
+from .mongo_v4_to_v5 import *
 
 __all__ = ("MongoMigrationManager",)
@@ -0,0 +1,19 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from nonebot_plugin_pixivbot.data.source.mongo.migration.mongo_migration import MongoMigration
+from nonebot_plugin_pixivbot.data.source.mongo.migration.mongo_migration_manager import MongoMigrationManager
+from nonebot_plugin_pixivbot.global_context import context
+
+
+@context.require(MongoMigrationManager).register
+class MongoV2ToV3(MongoMigration):
+    from_db_version = 2
+    to_db_version = 3
+
+    async def migrate(self, db: AsyncIOMotorDatabase):
+        # 图片内容移出download_cache，改由ImageStore保存
+        # 旧的缓存直接丢弃，TTL索引由MongoDataSource重建为普通索引
+        await db["download_cache"].delete_many({})
+
+
+__all__ = ("MongoV2ToV3",)
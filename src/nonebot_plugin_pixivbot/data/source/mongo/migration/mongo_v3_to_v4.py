@@ -0,0 +1,24 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure
+
+from nonebot_plugin_pixivbot.data.source.mongo.migration.mongo_migration import MongoMigration
+from nonebot_plugin_pixivbot.data.source.mongo.migration.mongo_migration_manager import MongoMigrationManager
+from nonebot_plugin_pixivbot.global_context import context
+
+
+@context.require(MongoMigrationManager).register
+class MongoV3ToV4(MongoMigration):
+    from_db_version = 3
+    to_db_version = 4
+
+    async def migrate(self, db: AsyncIOMotorDatabase):
+        # download_cache改为按(illust_id, page, quantity, profile)索引
+        # 旧的缓存无法确定尺寸及压缩配置，直接丢弃
+        try:
+            await db["download_cache"].drop_index([("illust_id", 1)])
+        except OperationFailure:
+            pass
+        await db["download_cache"].delete_many({})
+
+
+__all__ = ("MongoV3ToV4",)
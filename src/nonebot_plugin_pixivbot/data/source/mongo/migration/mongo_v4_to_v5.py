@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from nonebot_plugin_pixivbot.data.source.mongo.illust_summary import ILLUST_SUMMARY_VERSION, aggregate_list_summaries
+from nonebot_plugin_pixivbot.data.source.mongo.migration.mongo_migration import MongoMigration
+from nonebot_plugin_pixivbot.data.source.mongo.migration.mongo_migration_manager import MongoMigrationManager
+from nonebot_plugin_pixivbot.global_context import context
+
+
+@context.require(MongoMigrationManager).register
+class MongoV4ToV5(MongoMigration):
+    from_db_version = 4
+    to_db_version = 5
+
+    async def migrate(self, db: AsyncIOMotorDatabase):
+        # 列表缓存文档内嵌每项的摘要（summaries），读取列表时不再需要$lookup插画详情
+        for coll_name in ("search_illust_cache", "user_illusts_cache", "user_bookmarks_cache",
+                          "related_illusts_cache", "other_cache"):
+            summaries_of = await aggregate_list_summaries(db, coll_name, {"illust_id": {"$exists": True}})
+            for _id, summaries in summaries_of.items():
+                await db[coll_name].update_one({"_id": _id},
+                                               {"$set": {
+                                                   "summaries": summaries,
+                                                   "summary_version": ILLUST_SUMMARY_VERSION,
+                                                   "summary_time": datetime.now()
+                                               }})
+
+
+__all__ = ("MongoV4ToV5",)
@@ -12,7 +12,7 @@ from nonebot_plugin_pixivbot.utils.lifecycler import on_startup, on_shutdown
 @context.register_singleton()
 class MongoDataSource:
     conf = context.require(Config)
-    app_db_version = 2
+    app_db_version = 5
 
     def __init__(self):
         self._client = None
@@ -58,6 +58,13 @@ class MongoDataSource:
             await db[coll_name].drop_index(indexes)
             await db[coll_name].create_index(indexes, **kwargs)
 
+    def _cache_ttl(self, expires_in: int) -> int:
+        # stale-while-revalidate：缓存过期后仍在Mongo中保留一段时间，供读取时先返回旧内容
+        if self.conf.pixiv_cache_stale_while_revalidate:
+            return expires_in + self.conf.pixiv_cache_stale_max_age
+        else:
+            return expires_in
+
     @staticmethod
     async def _ensure_ttl_index(db: AsyncIOMotorDatabase, coll_name: str, expires_in: int):
         try:
@@ -92,35 +99,48 @@ class MongoDataSource:
         await self._ensure_index(db, 'local_tags', [("name", 1)], unique=True)
         await self._ensure_index(db, 'local_tags', [("translated_name", 1)])
 
-        await self._ensure_index(db, 'download_cache', [("illust_id", 1)], unique=True)
-        await self._ensure_ttl_index(db, 'download_cache', self.conf.pixiv_download_cache_expires_in)
+        # 图片保存在ImageStore中，过期清理由LocalPixivRepo.clean_image_cache负责，此处不能使用TTL索引
+        await self._ensure_index(db, 'download_cache',
+                                 [("illust_id", 1), ("page", 1), ("quantity", 1), ("profile", 1)], unique=True)
+        await self._ensure_index(db, 'download_cache', [("update_time", 1)])
+        await self._ensure_index(db, 'download_cache', [("last_access_time", 1)])
+        await self._ensure_index(db, 'download_cache', [("access_count", 1), ("last_access_time", 1)])
 
         await self._ensure_index(db, 'illust_detail_cache', [("illust.id", 1)], unique=True)
-        await self._ensure_ttl_index(db, 'illust_detail_cache', self.conf.pixiv_illust_detail_cache_expires_in)
+        await self._ensure_ttl_index(db, 'illust_detail_cache',
+                                     self._cache_ttl(self.conf.pixiv_illust_detail_cache_expires_in))
 
         await self._ensure_index(db, 'user_detail_cache', [("user.id", 1)], unique=True)
-        await self._ensure_ttl_index(db, 'user_detail_cache', self.conf.pixiv_user_detail_cache_expires_in)
+        await self._ensure_ttl_index(db, 'user_detail_cache',
+                                     self._cache_ttl(self.conf.pixiv_user_detail_cache_expires_in))
 
         await self._ensure_index(db, 'illust_ranking_cache', [("mode", 1)], unique=True)
-        await self._ensure_ttl_index(db, 'illust_ranking_cache', self.conf.pixiv_illust_ranking_cache_expires_in)
+        await self._ensure_ttl_index(db, 'illust_ranking_cache',
+                                     self._cache_ttl(self.conf.pixiv_illust_ranking_cache_expires_in))
 
         await self._ensure_index(db, 'search_illust_cache', [("word", 1)], unique=True)
-        await self._ensure_ttl_index(db, 'search_illust_cache', self.conf.pixiv_search_illust_cache_expires_in)
+        await self._ensure_ttl_index(db, 'search_illust_cache',
+                                     self._cache_ttl(self.conf.pixiv_search_illust_cache_expires_in))
 
         await self._ensure_index(db, 'search_user_cache', [("word", 1)], unique=True)
-        await self._ensure_ttl_index(db, 'search_user_cache', self.conf.pixiv_search_user_cache_expires_in)
+        await self._ensure_ttl_index(db, 'search_user_cache',
+                                     self._cache_ttl(self.conf.pixiv_search_user_cache_expires_in))
 
         await self._ensure_index(db, 'user_illusts_cache', [("user_id", 1)], unique=True)
-        await self._ensure_ttl_index(db, 'user_illusts_cache', self.conf.pixiv_user_illusts_cache_expires_in)
+        await self._ensure_ttl_index(db, 'user_illusts_cache',
+                                     self._cache_ttl(self.conf.pixiv_user_illusts_cache_expires_in))
 
         await self._ensure_index(db, 'user_bookmarks_cache', [("user_id", 1)], unique=True)
-        await self._ensure_ttl_index(db, 'user_bookmarks_cache', self.conf.pixiv_user_bookmarks_cache_expires_in)
+        await self._ensure_ttl_index(db, 'user_bookmarks_cache',
+                                     self._cache_ttl(self.conf.pixiv_user_bookmarks_cache_expires_in))
 
         await self._ensure_index(db, 'related_illusts_cache', [("original_illust_id", 1)], unique=True)
-        await self._ensure_ttl_index(db, 'related_illusts_cache', self.conf.pixiv_related_illusts_cache_expires_in)
+        await self._ensure_ttl_index(db, 'related_illusts_cache',
+                                     self._cache_ttl(self.conf.pixiv_related_illusts_cache_expires_in))
 
         await self._ensure_index(db, 'other_cache', [("type", 1)], unique=True)
-        await self._ensure_ttl_index(db, 'other_cache', self.conf.pixiv_other_cache_expires_in)
+        await self._ensure_ttl_index(db, 'other_cache',
+                                     self._cache_ttl(self.conf.pixiv_other_cache_expires_in))
 
         self._client = client
         self._db = db
@@ -0,0 +1,26 @@
+from nonebot_plugin_pixivbot.config import Config
+from nonebot_plugin_pixivbot.context import Context
+from nonebot_plugin_pixivbot.data.image_store import ImageStore, LocalImageStore, GridFSImageStore
+from nonebot_plugin_pixivbot.enums import ImageStoreType
+
+
+def image_store_provider(context: Context):
+    def build():
+        conf = context.require(Config)
+        if conf.pixiv_image_store == ImageStoreType.gridfs:
+            return context.require(GridFSImageStore)
+        else:
+            return context.require(LocalImageStore)
+
+    context.register_lazy(ImageStore, build)
+
+
+providers = [image_store_provider]
+
+
+def provide(context: Context):
+    for p in providers:
+        p(context)
+
+
+__all__ = ("provide",)
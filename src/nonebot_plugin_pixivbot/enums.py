@@ -1,6 +1,7 @@
 from enum import Enum
 
-__all__ = ("BlockAction", "DownloadQuantity", "RandomIllustMethod", "RankingMode")
+__all__ = ("BlockAction", "CacheEvictionPolicy", "CompressorBackend", "DownloadQuantity", "ImageStoreType",
+           "RandomIllustMethod", "RankingMode")
 
 
 class BlockAction(Enum):
@@ -9,6 +10,16 @@ class BlockAction(Enum):
     no_reply = 'no_reply'
 
 
+class CacheEvictionPolicy(Enum):
+    lru = 'lru'
+    lfu = 'lfu'
+
+
+class CompressorBackend(Enum):
+    thread = 'thread'
+    process = 'process'
+
+
 class DownloadQuantity(Enum):
     original = 'original'
     square_medium = 'square_medium'
@@ -16,6 +27,11 @@ class DownloadQuantity(Enum):
     large = 'large'
 
 
+class ImageStoreType(Enum):
+    local = 'local'
+    gridfs = 'gridfs'
+
+
 class RandomIllustMethod(Enum):
     uniform = 'uniform'
     bookmark_proportion = 'bookmark_proportion'
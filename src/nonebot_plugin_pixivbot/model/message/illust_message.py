@@ -1,5 +1,4 @@
-from io import BytesIO
-from typing import Optional
+from typing import Optional, List
 
 from pydantic import BaseModel
 
@@ -19,6 +18,8 @@ class IllustMessageModel(BaseModel):
     create_time: str = ""
     link: str = ""
     image: bytes = bytes(0)
+    # 获取了多页时为各页（第一项即image），否则为空
+    images: List[bytes] = []
 
     header: Optional[str] = None
     number: Optional[int] = None
@@ -42,10 +43,11 @@ class IllustMessageModel(BaseModel):
             elif conf.pixiv_block_action == BlockAction.no_reply:
                 return None
         else:
-            with BytesIO() as bio:
-                repo = context.require(PixivRepo)
-                bio.write(await repo.image(illust))
-                model.image = bio.getvalue()
+            repo = context.require(PixivRepo)
+            images = await repo.images(illust)
+            model.image = images[0]
+            if len(images) > 1:
+                model.images = images
 
         model.title = illust.title
         model.author = f"{illust.user.name} ({illust.user.id})"
@@ -53,3 +55,11 @@ class IllustMessageModel(BaseModel):
         model.link = f"https://www.pixiv.net/artworks/{illust.id}"
 
         return model
+
+    def pages(self) -> List["IllustMessageModel"]:
+        """
+        将多页插画拆分为每页一条消息（不复制图片内容），单页时返回[self]
+        """
+        if len(self.images) <= 1:
+            return [self]
+        return [self.copy(update={"image": x, "images": []}) for x in self.images]
@@ -1,6 +1,11 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import TypeVar, Generic
+from contextvars import ContextVar
+from datetime import datetime
+from time import time
+from typing import TypeVar, Generic, Optional, Dict, Tuple
 
+from nonebot_plugin_pixivbot.config import Config
 from nonebot_plugin_pixivbot.global_context import context
 from nonebot_plugin_pixivbot.model.message import IllustMessageModel, IllustMessagesModel
 from nonebot_plugin_pixivbot.protocol_dep.post_dest import PostDestination
@@ -11,6 +16,12 @@ GID = TypeVar("GID")
 
 PD = PostDestination[UID, GID]
 
+# 设置后，PostmanManager在该时间之前不发送消息（用于提前获取订阅内容，到达订阅时间时才发送）
+post_not_before: ContextVar[Optional[datetime]] = ContextVar("post_not_before", default=None)
+
+# 设置后，PostmanManager在准备发送（即内容已获取完毕，开始等待post_not_before之前）时set该Event
+post_ready: ContextVar[Optional[asyncio.Event]] = ContextVar("post_ready", default=None)
+
 
 class Postman(ProtocolDep, ABC, Generic[UID, GID]):
     @abstractmethod
@@ -28,20 +39,73 @@ class Postman(ProtocolDep, ABC, Generic[UID, GID]):
                            *, post_dest: PD):
         raise NotImplementedError()
 
+    async def send_illust_pages(self, model: IllustMessageModel,
+                                *, post_dest: PD):
+        """
+        发送多页插画（model.images）。默认实现将每页拆为一条消息，通过send_illusts作为一批发送
+        """
+        await self.send_illusts(IllustMessagesModel(header=model.header, messages=model.pages()),
+                                post_dest=post_dest)
+
 
 @context.register_singleton()
 class PostmanManager(ProtocolDepManager[Postman]):
+    conf = context.require(Config)
+
+    def __init__(self):
+        super().__init__()
+        # 以(adapter, bot的self_id)为键
+        self._post_locks: Dict[Tuple[str, Optional[str]], asyncio.Lock] = {}
+        self._last_post_time: Dict[Tuple[str, Optional[str]], float] = {}
+
+    @staticmethod
+    def _bot_key(post_dest: PD) -> Tuple[str, Optional[str]]:
+        # 各协议的PostDestination实现通常持有发送消息的bot；没有时同一adapter的所有bot共用一个限制
+        bot = getattr(post_dest, "bot", None)
+        return post_dest.adapter, getattr(bot, "self_id", None)
+
+    async def _before_post(self, post_dest: PD):
+        ready = post_ready.get()
+        if ready is not None:
+            ready.set()
+
+        not_before = post_not_before.get()
+        if not_before is not None:
+            delay = (not_before - datetime.now()).total_seconds()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        # 同一bot的两次发送至少间隔pixiv_post_interval秒
+        interval = self.conf.pixiv_post_interval
+        if interval > 0:
+            key = self._bot_key(post_dest)
+            lock = self._post_locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                delay = self._last_post_time.get(key, 0) + interval - time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self._last_post_time[key] = time()
+
     async def send_plain_text(self, message: str,
                               *, post_dest: PD):
+        await self._before_post(post_dest)
         return await self[post_dest.adapter].send_plain_text(message, post_dest=post_dest)
 
     async def send_illust(self, model: IllustMessageModel,
                           *, post_dest: PD):
+        await self._before_post(post_dest)
+        if len(model.images) > 1:
+            return await self[post_dest.adapter].send_illust_pages(model, post_dest=post_dest)
         return await self[post_dest.adapter].send_illust(model, post_dest=post_dest)
 
     async def send_illusts(self, model: IllustMessagesModel,
                            *, post_dest: PD):
+        await self._before_post(post_dest)
+        if any(len(x.images) > 1 for x in model.messages):
+            # 多页插画的每页各作为一条消息
+            model = IllustMessagesModel(header=model.header,
+                                        messages=[page for x in model.messages for page in x.pages()])
         return await self[post_dest.adapter].send_illusts(model, post_dest=post_dest)
 
 
-__all__ = ("Postman", "PostmanManager")
+__all__ = ("Postman", "PostmanManager", "post_not_before", "post_ready")
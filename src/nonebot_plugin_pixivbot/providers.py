@@ -1,6 +1,7 @@
-from . import nb_providers
+from . import nb_providers, data_providers
 from .context import Context
 
 
 def provide(context: Context):
     nb_providers.provide(context)
+    data_providers.provide(context)
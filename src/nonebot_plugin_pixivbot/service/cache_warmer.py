@@ -0,0 +1,55 @@
+import asyncio
+from typing import List
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+from nonebot import logger
+
+from nonebot_plugin_pixivbot.config import Config
+from nonebot_plugin_pixivbot.data.pixiv_repo import PixivRepo
+from nonebot_plugin_pixivbot.enums import RankingMode
+from nonebot_plugin_pixivbot.global_context import context
+from nonebot_plugin_pixivbot.model import Illust
+from nonebot_plugin_pixivbot.service.pixiv_service import PixivService
+
+
+@context.register_eager_singleton()
+class CacheWarmer:
+    """
+    在Pixiv榜单更新后预先获取所有榜单，并下载（压缩）pixiv_ranking_default_range范围内的插画
+    """
+    conf = context.require(Config)
+
+    def __init__(self):
+        self.apscheduler = context.require(AsyncIOScheduler)
+        self.repo = context.require(PixivRepo)
+        self.service = context.require(PixivService)
+
+        if self.conf.pixiv_ranking_warm_up_enabled:
+            hour, minute = map(int, self.conf.pixiv_ranking_warm_up_time.split(":"))
+            trigger = CronTrigger(hour=hour, minute=minute, timezone="Asia/Tokyo")
+            self.apscheduler.add_job(self.warm_up_ranking, id="warm up ranking", trigger=trigger)
+            logger.success(f"scheduled warm up ranking {trigger}")
+
+    async def _warm_up_images(self, illusts: List[Illust]):
+        block_tags = self.conf.pixiv_block_tags
+        illusts = [x for x in illusts if not x.has_tags(block_tags)]
+
+        # 与发送消息时一样通过images获取，多页插画的各页都被预热
+        results = await asyncio.gather(*[self.repo.images(x) for x in illusts], return_exceptions=True)
+        for x, result in zip(illusts, results):
+            if isinstance(result, Exception):
+                logger.warning(f"[warm up] failed to download images of {x.id}: {result}")
+
+    async def warm_up_ranking(self):
+        for mode in RankingMode:
+            try:
+                await self.repo.illust_ranking(mode, force_fetch=True)
+                illusts = await self.service.illust_ranking(mode, self.conf.pixiv_ranking_default_range)
+                await self._warm_up_images(illusts)
+                logger.info(f"[warm up] {mode.name} ranking warmed up")
+            except Exception as e:
+                logger.opt(exception=e).error(f"[warm up] failed to warm up {mode.name} ranking")
+
+
+__all__ = ("CacheWarmer",)
@@ -20,6 +20,18 @@ class PixivService:
         self.data_source = context.require(PixivRepo)
         self.local_tags = context.require(LocalTagRepo)
 
+    async def _load(self, illusts: Sequence[LazyIllust]) -> List[Illust]:
+        illusts = list(illusts)
+
+        # 未加载详情的项通过一次批量查询加载
+        missing = [x for x in illusts if not x.loaded]
+        if len(missing) != 0:
+            details = await self.data_source.illust_details([x.id for x in missing])
+            for x, illust in zip(missing, details):
+                x.content = illust
+
+        return [x.content for x in illusts]
+
     async def _choice_and_load(self, illusts: List[LazyIllust], random_method: RandomIllustMethod, count: int) \
             -> List[Illust]:
         if count <= 0:
@@ -31,13 +43,12 @@ class PixivService:
 
         winners = roulette(illusts, random_method, count)
         logger.info(f"choice {[x.id for x in winners]}")
-        return [await x.get() for x in winners]
+        return await self._load(winners)
 
     async def illust_ranking(self, mode: str, range: Sequence[int]) -> List[Illust]:
         start, end = range
         illusts = await self.data_source.illust_ranking(mode, skip=start - 1, limit=end - start + 1)
-
-        return [await x.get() for x in illusts]
+        return await self._load(illusts)
 
     async def illust_detail(self, illust: int) -> Illust:
         return await self.data_source.illust_detail(illust)
@@ -52,7 +63,11 @@ class PixivService:
                     logger.info(f"found translation {word} -> {tag.name}")
                     word = tag.name
 
-        illusts = await self.data_source.search_illust(word)
+        if self.conf.pixiv_random_illust_eager_fetch:
+            # 缓存未命中时从先获取到的页中抽选，剩余的页在后台继续获取
+            illusts = await self.data_source.search_illust(word, eager_item=count)
+        else:
+            illusts = await self.data_source.search_illust(word)
         return await self._choice_and_load(illusts, self.conf.pixiv_random_illust_method, count)
 
     async def get_user(self, user: Union[str, int]) -> User:
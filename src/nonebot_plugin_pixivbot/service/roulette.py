@@ -1,63 +1,51 @@
 from time import time
+from typing import List, Sequence
 
 import numpy as np
 
-from nonebot_plugin_pixivbot.data.pixiv_repo import LazyIllust
+from nonebot_plugin_pixivbot.data.pixiv_repo import LazyIllust, IllustList
 from nonebot_plugin_pixivbot.enums import RandomIllustMethod
+from nonebot_plugin_pixivbot.utils.errors import QueryError
 
 
-def uniform(illusts: list[LazyIllust]) -> np.ndarray:
-    # 概率相等
-    n = len(illusts)
-    return np.ones(n) / n
+# 以下函数返回每项的对数权重（-inf表示不可能被抽中），除了与当前时间相关的timedelta_proportion，结果都缓存在列表上
 
+def _uniform(illusts: IllustList) -> np.ndarray:
+    return np.zeros(len(illusts))
 
-def bookmark_proportion(illusts: list[LazyIllust]) -> np.ndarray:
-    # 概率正比于书签数
-    n = len(illusts)
-    p = [0] * n
 
-    for i, x in enumerate(illusts):
-        if x.loaded:
-            p[i] = x.content.total_bookmarks + 10  # 加10平滑
-        else:
-            p[i] = 0
+def uniform(illusts: IllustList) -> np.ndarray:
+    # 概率相等
+    return illusts.derive(RandomIllustMethod.uniform, _uniform)
 
-    p = np.array(p)
-    return p / np.sum(p)
 
+def _bookmark_proportion(illusts: IllustList) -> np.ndarray:
+    return np.where(illusts.loaded, np.log(illusts.total_bookmarks + 10), -np.inf)  # 加10平滑
 
-def view_proportion(illusts: list[LazyIllust]) -> np.ndarray:
-    # 概率正比于查看人数
-    n = len(illusts)
-    p = [0] * n
 
-    for i, x in enumerate(illusts):
-        if x.loaded:
-            p[i] = x.content.total_view + 10  # 加10平滑
-        else:
-            p[i] = 0
+def bookmark_proportion(illusts: IllustList) -> np.ndarray:
+    # 概率正比于书签数
+    return illusts.derive(RandomIllustMethod.bookmark_proportion, _bookmark_proportion)
 
-    p = np.array(p)
-    return p / np.sum(p)
 
+def _view_proportion(illusts: IllustList) -> np.ndarray:
+    return np.where(illusts.loaded, np.log(illusts.total_view + 10), -np.inf)  # 加10平滑
 
-def timedelta_proportion(illusts: list[LazyIllust]) -> np.ndarray:
-    # 概率正比于 exp(归一化后的画像发布时间差)
-    n = len(illusts)
-    p = [0] * n
 
-    now = time()
-    for i, x in enumerate(illusts):
-        if x.loaded:
-            p[i] = x.create_date.timestamp() - now
-        else:
-            p[i] = float("-inf")
+def view_proportion(illusts: IllustList) -> np.ndarray:
+    # 概率正比于查看人数
+    return illusts.derive(RandomIllustMethod.view_proportion, _view_proportion)
+
 
-    p = np.array(p)
-    p = p / (-np.min(p))  # 归一化
-    p = np.exp(p)
-    return p / np.sum(p)
+def timedelta_proportion(illusts: IllustList) -> np.ndarray:
+    # 概率正比于 exp(归一化后的画像发布时间差)，对数权重即归一化后的时间差
+    loaded = illusts.loaded
+
+    p = illusts.create_timestamp - time()
+    scale = -np.min(p[loaded]) if np.any(loaded) else 0
+    if scale > 0:
+        p = p / scale  # 归一化
+    return np.where(loaded, p, -np.inf)
 
 
 p_gen = {
@@ -68,14 +56,24 @@ p_gen = {
 }
 
 
-def roulette(illusts: list[LazyIllust], random_method: RandomIllustMethod, k: int) -> list[LazyIllust]:
+def roulette(illusts: Sequence[LazyIllust], random_method: RandomIllustMethod, k: int) -> List[LazyIllust]:
     if random_method not in p_gen:
         raise ValueError(f"illegal random_method: {random_method}")
 
-    n = len(illusts)
-    p = p_gen[random_method](illusts)
-    # print([(illusts[i].content.create_date, p[i]) for i in range(n)])
+    items = illusts
+    if not isinstance(illusts, IllustList):
+        illusts = IllustList(illusts)
+
+    log_p = np.where(illusts.blocked, -np.inf, p_gen[random_method](illusts))
 
+    # Gumbel-top-k：对数权重加上Gumbel噪声后取最大的k项，等价于按权重不放回地抽样k次
     rng = np.random.default_rng()
-    winners = rng.choice(n, k, False, p)
-    return [illusts[c] for c in winners]
+    keys = log_p + rng.gumbel(size=len(log_p))
+    # 屏蔽的及（按书签数等抽取时）未加载的项不可能被抽中
+    if k > np.count_nonzero(np.isfinite(keys)):
+        raise QueryError("别看了，没有的。")
+
+    winners = np.argpartition(-keys, k - 1)[:k]
+    winners = winners[np.argsort(-keys[winners])]
+    # 从原列表中取出，未经列存储的列表中已加载的详情得以保留
+    return [items[c] for c in winners]
@@ -1,19 +1,24 @@
 from __future__ import annotations
 
+import random
 import re
+from asyncio import gather, create_task, wait, Event, FIRST_COMPLETED
 from datetime import datetime, timedelta
 from inspect import isawaitable
-from typing import TypeVar, Dict, List, Sequence, Union, Optional, TYPE_CHECKING
+from typing import TypeVar, Dict, List, Sequence, Union, Optional, Tuple, TYPE_CHECKING
 
+from apscheduler.jobstores.base import JobLookupError
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from lazy import lazy
 from nonebot import logger, Bot
 
+from nonebot_plugin_pixivbot.config import Config
 from nonebot_plugin_pixivbot.data.subscription_repo import SubscriptionRepo
 from nonebot_plugin_pixivbot.global_context import context
 from nonebot_plugin_pixivbot.model import Subscription, PostIdentifier
 from nonebot_plugin_pixivbot.protocol_dep.post_dest import PostDestination, PostDestinationFactoryManager
+from nonebot_plugin_pixivbot.protocol_dep.postman import post_not_before, post_ready
 from nonebot_plugin_pixivbot.utils.errors import BadRequestError
 from nonebot_plugin_pixivbot.utils.lifecycler import on_bot_connect, on_bot_disconnect
 from nonebot_plugin_pixivbot.utils.nonebot import get_adapter_name
@@ -29,10 +34,17 @@ ID = PostIdentifier[UID, GID]
 
 @context.register_eager_singleton()
 class Scheduler:
+    conf = context.require(Config)
+
     def __init__(self):
         self.apscheduler = context.require(AsyncIOScheduler)
         self.subscriptions = context.require(SubscriptionRepo)
 
+        # group_key -> {job_id -> (post_dest, subscription)}
+        self._groups: Dict[str, Dict[str, Tuple[PostDestination, Subscription]]] = {}
+        # job_id -> group_key
+        self._job_group: Dict[str, str] = {}
+
         on_bot_connect(self.on_bot_connect, replay=True)
         on_bot_disconnect(self.on_bot_disconnect)
 
@@ -86,21 +98,79 @@ class Scheduler:
             RandomUserIllustHandler.type(): context.require(RandomUserIllustHandler),
         }
 
+    @staticmethod
+    def _make_group_key(sub: Subscription[UID, GID]) -> str:
+        # 类型、时间及参数都相同的订阅归为一组，由同一个job触发
+        return f'{sub.type} {tuple(sub.schedule)} {sorted(sub.kwargs.items())}'
+
+    async def _handle_group(self, group_key: str):
+        group = self._groups.get(group_key)
+        if not group:
+            return
+
+        lead = self.conf.pixiv_subscription_prefetch_lead
+        jitter = self.conf.pixiv_subscription_jitter
+        start_time = datetime.now()
+
+        async def handle(post_dest: PostDestination[UID, GID], sub: Subscription[UID, GID], delay: float,
+                         ready: Optional[Event] = None):
+            # 提前lead秒开始获取插画及下载图片，到达订阅时间（再加上随机的delay）时才发送
+            post_not_before.set(start_time + timedelta(seconds=lead + delay))
+            post_ready.set(ready)
+            try:
+                await self._handlers[sub.type].handle(post_dest=post_dest, silently=True, **sub.kwargs)
+            except Exception as e:
+                logger.opt(exception=e).error(
+                    f"error occurred when handle {self._make_job_id(sub.type, sub.identifier)}")
+
+        # 先处理组内的第一个订阅，组内共用的数据（如同一个榜单及其图片）只获取一次，其余订阅直接从缓存读取
+        # 第一个订阅获取完毕（开始等待发送）或结束后即开始处理其余订阅，不等待其发送
+        (first_post_dest, first_sub), *others = group.values()
+        ready = Event()
+        first = create_task(handle(first_post_dest, first_sub, 0, ready))
+        ready_waiter = create_task(ready.wait())
+        await wait([first, ready_waiter], return_when=FIRST_COMPLETED)
+        ready_waiter.cancel()
+
+        await gather(first, *[handle(post_dest, sub, random.uniform(0, jitter)) for post_dest, sub in others])
+
     def _add_job(self, post_dest: PostDestination[UID, GID], sub: Subscription[UID, GID]):
-        offset_hour, offset_minute, hours, minutes = sub.schedule
-        trigger = IntervalTrigger(hours=hours, minutes=minutes,
-                                  start_date=datetime.now().replace(hour=offset_hour, minute=offset_minute,
-                                                                    second=0, microsecond=0) + timedelta(days=-1))
+        job_id = self._make_job_id(sub.type, sub.identifier)
+        group_key = self._make_group_key(sub)
+
+        if job_id in self._job_group:
+            # 重复添加（如bot重连、订阅的时间变化）时先从原来的组中移除，原来的组因此为空时其任务一并移除
+            self._remove_job(sub.type, sub.identifier)
 
-        identifier = sub.identifier
-        job_id = self._make_job_id(sub.type, identifier)
-        self.apscheduler.add_job(self._handlers[sub.type].handle, id=job_id, trigger=trigger,
-                                 kwargs={"post_dest": post_dest, "silently": True, **sub.kwargs})
-        logger.success(f"scheduled {job_id} {trigger}")
+        group = self._groups.setdefault(group_key, {})
+        group[job_id] = (post_dest, sub)
+        self._job_group[job_id] = group_key
+
+        if len(group) == 1:
+            offset_hour, offset_minute, hours, minutes = sub.schedule
+            lead = self.conf.pixiv_subscription_prefetch_lead
+            trigger = IntervalTrigger(hours=hours, minutes=minutes,
+                                      start_date=datetime.now().replace(hour=offset_hour, minute=offset_minute,
+                                                                        second=0, microsecond=0)
+                                                 + timedelta(days=-1, seconds=-lead))
+            # 上一次尚未处理完时不再重复触发，错过的多次触发合并为一次
+            self.apscheduler.add_job(self._handle_group, id=f'scheduled group {group_key}', trigger=trigger,
+                                     kwargs={"group_key": group_key}, max_instances=1, coalesce=True)
+            logger.success(f"scheduled group {group_key} {trigger}")
+        logger.success(f"scheduled {job_id} (group {group_key})")
 
     def _remove_job(self, type: str, identifier: ID):
         job_id = self._make_job_id(type, identifier)
-        self.apscheduler.remove_job(job_id)
+        if job_id not in self._job_group:
+            raise JobLookupError(job_id)
+
+        group_key = self._job_group.pop(job_id)
+        group = self._groups[group_key]
+        del group[job_id]
+        if len(group) == 0:
+            del self._groups[group_key]
+            self.apscheduler.remove_job(f'scheduled group {group_key}')
+            logger.success(f"unscheduled group {group_key}")
         logger.success(f"unscheduled {job_id}")
 
     async def on_bot_connect(self, bot: Bot):
@@ -6,6 +6,17 @@ class QueryError(Exception):
         return self.message
 
 
+class RateLimitError(QueryError):
+    """
+    被Pixiv限流
+    :param retry_after: 服务器要求的重试间隔（单位：秒），未知时为None
+    """
+
+    def __init__(self, message="请求过于频繁，请稍后再试", retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
 class BadRequestError(Exception):
     def __init__(self, message=None):
         super().__init__()
@@ -15,4 +26,4 @@ class BadRequestError(Exception):
         return self.message
 
 
-__all__ = ("QueryError", "BadRequestError")
+__all__ = ("QueryError", "RateLimitError", "BadRequestError")